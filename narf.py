@@ -12,20 +12,99 @@ import sys  # noqa: E402
 sys.path.insert(0, '/usr/local/nutanix/bin/')  # noqa: E402
 
 import os
+import atexit
+import operator
+import heapq
+import contextlib
+import functools
+import importlib
+import fcntl
+import timeit
+import math
+import select
 import signal
-import uuid
-import curses
+import array
+import numbers
+import struct
+import threading
 import argparse
 import datetime
 import time
-import env
 
-from util.interfaces.interfaces import NutanixInterfaces  # noqa: E402
-from stats.arithmos.interface.arithmos_type_pb2 import *  # noqa: E402
-from stats.arithmos.interface.arithmos_interface_pb2 import (
-    AgentGetEntitiesArg, MasterGetEntitiesArg)  # noqa: E402
-from serviceability.interface.analytics.arithmos_rpc_client import (
-    ArithmosDataProcessing)  # noqa: E402
+try:
+    INTEGER_TYPES = (int, long)
+except NameError:
+    INTEGER_TYPES = (int,)
+NUMBER_TYPES = INTEGER_TYPES + (float,)
+
+# Modules needed only by some modes are imported the first time they are
+# used, so one-shot reports run from cron don't pay for curses, numpy, the
+# exporter or the Nutanix RPC stack. Names are None until imported.
+curses = None
+json = zlib = hashlib = None
+httplib = queue = urlparse = socket = None
+symbol_database = None
+ArithmosEntityProto = ArithmosErrorProto = None
+MasterGetTimeRangeStatsArg = None
+_optional_modules = {}
+
+
+def _import_optional(name):
+    """
+    Returns the optional module name (numpy, lzma, tracemalloc), None if
+    it is not installed.
+    """
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+def _import_arithmos():
+    """
+    Arithmos protos, needed by reporters and datasources. The RPC clients
+    are imported by ArithmosDataSource when it connects.
+    """
+    global symbol_database, ArithmosEntityProto, ArithmosErrorProto
+    global MasterGetTimeRangeStatsArg
+    if ArithmosEntityProto is not None:
+        return
+    import env  # noqa: F401
+    from google.protobuf import symbol_database
+    from stats.arithmos.interface.arithmos_type_pb2 import (
+        ArithmosEntityProto, ArithmosErrorProto)
+    from stats.arithmos.interface.arithmos_interface_pb2 import (
+        MasterGetTimeRangeStatsArg)
+
+
+def _import_curses():
+    global curses
+    import curses
+
+
+def _import_serialization():
+    """
+    Modules used by the cache, snapshots, recordings and the exporter.
+    """
+    global json, zlib, hashlib
+    import json
+    import zlib
+    import hashlib
+
+
+def _import_http():
+    global httplib, queue, urlparse, socket
+    import socket
+    try:
+        import httplib
+        import Queue as queue
+        from urlparse import urlparse
+    except ImportError:
+        import http.client as httplib
+        import queue
+        from urllib.parse import urlparse
 
 # ~~~ Report fields definitions ~~~
 # Arithmos fields are used by the report methods in the reporter classes,
@@ -366,54 +445,1782 @@ VG_OVERALL_REPORT_CLI_FIELDS = (
 )
 
 # ========================================================================
+# Unit conversions made by reporters, see Reporter._stats_unit_conversion().
+# Stats with the unit in the name are renamed with the new unit and their
+# values divided by the divisor. The first matching unit is used.
+UNIT_CONVERSIONS = [
+    ("ppm", "percent", 10000),
+    ("kBps", "mBps", 1024),
+    ("bytes", "Mbytes", 1048576),
+    ("usecs", "msecs", 1000),
+]
+
+# ========================================================================
+# Arithmos query settings.
+
+# Maximum number of entity/stat requests packed in a single
+# MasterGetTimeRangeStats RPC. Every request carries its own entity id and
+# stat name, arithmos answers with one response per request in the same
+# order.
+TIME_RANGE_STATS_BATCH_SIZE = 500
+
+# Time range reports fetch the samples of a whole window at once and split
+# them locally in intervals of 'sec' seconds. This is the maximum number of
+# intervals covered by a single window, longer time ranges are fetched in
+# several windows to keep memory bounded.
+TIME_RANGE_WINDOW_MAX_INTERVALS = 360
+
+# Default number of MasterGetTimeRangeStats RPCs in flight at the same time,
+# it can be changed with --jobs.
+DEFAULT_JOBS = 4
+
+# Historic samples are cached on disk in blocks of CACHE_BLOCK_SECS
+# seconds, see TimeRangeStatsCache. Blocks ending less than
+# CACHE_SETTLE_SECS ago are not cached because arithmos may still be
+# receiving samples for them. The cache size can be changed with
+# --cache-size and the cache disabled with --no-cache.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".narf", "cache")
+DEFAULT_CACHE_SIZE_MB = 32
+CACHE_BLOCK_SECS = 3600
+CACHE_SETTLE_SECS = 600
+
+# Number of line protocol datapoints written at once by the exporter, it
+# can be changed with --batch-size.
+DEFAULT_EXPORT_BATCH_SIZE = 1000
+
+# Pushing datapoints to an InfluxDB compatible /api/v2/write endpoint with
+# --influx-url. Batches are sent from a background thread, at most
+# INFLUX_MAX_IN_FLIGHT batches wait to be sent before the export blocks.
+# Failed batches are retried INFLUX_RETRIES times, waiting
+# INFLUX_RETRY_BACKOFF_SECS seconds the first time and doubling each time.
+DEFAULT_INFLUX_BATCH_SIZE = 5000
+INFLUX_MAX_IN_FLIGHT = 4
+INFLUX_RETRIES = 5
+INFLUX_RETRY_BACKOFF_SECS = 1
+INFLUX_TIMEOUT_SECS = 30
+
+# The interactive UI polls arithmos from a background thread every
+# INTERACTIVE_REFRESH_SECS seconds, the period can be set with the 'sec'
+# argument and changed with +/- between the MIN and MAX values. In
+# adaptive mode the period is stretched so fetching takes at most
+# INTERACTIVE_MAX_FETCH_SHARE of it. Data older than
+# INTERACTIVE_STALE_REFRESHES refresh periods is flagged as stale.
+INTERACTIVE_REFRESH_SECS = 3
+INTERACTIVE_MIN_REFRESH_SECS = 1
+INTERACTIVE_MAX_REFRESH_SECS = 60
+INTERACTIVE_MAX_FETCH_SHARE = 0.25
+INTERACTIVE_STALE_REFRESHES = 2
+
+# The interactive UI sleeps until a key is pressed or the poller publishes
+# something, waking up at least every INTERACTIVE_MAX_WAIT_SECS seconds
+# to notice terminal resizes.
+INTERACTIVE_MAX_WAIT_SECS = 1
+
+# Benchmark (--benchmark) settings. Size of the synthetic cluster as
+# "nodes,vms,vgs,samples", number of runs of every case, size of the
+# pseudo terminal used to measure the interactive UI and number of VMs of
+# the --top case.
+DEFAULT_BENCHMARK_SIZE = "4,200,20,120"
+BENCHMARK_RUNS = 5
+BENCHMARK_SCREEN_SIZE = (50, 160)
+BENCHMARK_TOP = 20
+
+# ========================================================================
+
+
+class TimeRangeStatsCache(object):
+    """
+    Persistent cache for time range stats returned by arithmos.
+
+    Samples that are already in the past never change, so reports over the
+    same time range can be served from disk instead of querying arithmos
+    again. Time is split in blocks of CACHE_BLOCK_SECS seconds aligned to
+    the epoch and the cache is a directory with one segment file per
+    cluster, entity type, sampling interval and block. Every segment holds
+    the samples of all the entity/stat pairs requested for that block:
+
+      cache_dir/<cluster_id>/<sha1 of entity type, interval, block start>
+
+    Since segments don't depend on the window of a report, any time range
+    inside blocks that are already cached is served without RPCs, whatever
+    its start, end or the length of its intervals.
+
+    Segments are zlib compressed and packed with struct:
+
+      +-------------+------------------+------------------------------+
+      | key length  | key (entity|stat)| start, interval, count, values|
+      +-------------+------------------+------------------------------+
+      |  ... one record per series ...                                |
+
+    When the size of the whole cache (all clusters) goes beyond
+    max_size_mb, least recently used segments (by modification time, which
+    is updated on every hit) are removed.
+
+    cluster_id can be a function returning the id, it is only called when
+    a segment is read or written, so live reports never need it.
+    """
+
+    _RECORD_KEY = struct.Struct("<I")
+    _RECORD_HEADER = struct.Struct("<qqI")
+
+    def __init__(self, cluster_id, cache_dir=DEFAULT_CACHE_DIR,
+                 max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        _import_serialization()
+        self.cluster_id = cluster_id
+        self.base_dir = cache_dir
+        self.max_size = max_size_mb * 1048576
+        self.block_usecs = CACHE_BLOCK_SECS * 1000000
+        self._cache_dir = None
+
+    @property
+    def cache_dir(self):
+        if self._cache_dir is None:
+            cluster_id = self.cluster_id
+            if callable(cluster_id):
+                cluster_id = cluster_id()
+            self._cache_dir = os.path.join(self.base_dir, str(cluster_id))
+        return self._cache_dir
+
+    def cacheable_span(self, start, end):
+        """
+        Returns the (start, end) tuple of the blocks overlapping the time
+        range between start and end that can be cached, or None if there
+        are none. Only blocks ending before CACHE_SETTLE_SECS ago are
+        cached, the span may begin before start and end before end.
+        """
+        settled = (int((time.time() - CACHE_SETTLE_SECS) * 1000000) //
+                   self.block_usecs * self.block_usecs)
+        span_start = start // self.block_usecs * self.block_usecs
+        span_end = min(-(-end // self.block_usecs) * self.block_usecs,
+                       settled)
+        if span_end <= start:
+            return None
+        return span_start, span_end
+
+    def _segment_path(self, entity_type, sampling_interval, block_start):
+        key = "{}|{}|{}".format(entity_type, sampling_interval, block_start)
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _series_key(self, entity_id, stat):
+        return "{}|{}".format(entity_id, stat)
+
+    def _read_segment(self, path):
+        """
+        Returns a dictionary with the series in the segment file, an empty
+        dictionary if the segment doesn't exist or can't be read.
+        """
+        segment = {}
+        try:
+            with open(path, "rb") as segment_file:
+                data = zlib.decompress(segment_file.read())
+            offset = 0
+            while offset < len(data):
+                key_len, = self._RECORD_KEY.unpack_from(data, offset)
+                offset += self._RECORD_KEY.size
+                key = data[offset:offset + key_len].decode("utf-8")
+                offset += key_len
+                start, interval, count = \
+                    self._RECORD_HEADER.unpack_from(data, offset)
+                offset += self._RECORD_HEADER.size
+                values = list(struct.unpack_from("<%dq" % count,
+                                                 data, offset))
+                offset += 8 * count
+                segment[key] = (start, interval, values)
+            os.utime(path, None)
+        except (IOError, OSError, zlib.error, struct.error):
+            return {}
+        return segment
+
+    def _write_segment(self, path, segment):
+        chunks = []
+        for key, (start, interval, values) in segment.items():
+            key = key.encode("utf-8")
+            chunks.append(self._RECORD_KEY.pack(len(key)))
+            chunks.append(key)
+            chunks.append(self._RECORD_HEADER.pack(start, interval,
+                                                   len(values)))
+            chunks.append(struct.pack("<%dq" % len(values),
+                                      *[int(value) for value in values]))
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, "wb") as segment_file:
+                segment_file.write(zlib.compress(b"".join(chunks)))
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            # The cache is an optimization, failing to write is not an error.
+            return False
+        return True
+
+    def _evict(self):
+        """
+        Remove least recently used segments, of any cluster, until the
+        cache fits in max_size.
+        """
+        segments = []
+        total_size = 0
+        try:
+            cluster_dirs = os.listdir(self.base_dir)
+        except OSError:
+            return
+        for cluster_dir in cluster_dirs:
+            cluster_dir = os.path.join(self.base_dir, cluster_dir)
+            try:
+                names = os.listdir(cluster_dir)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(cluster_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                segments.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        for mtime, size, path in sorted(segments):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
+    def _blocks(self, start, end):
+        return range(start, end, self.block_usecs)
+
+    def slice_series(self, series, start, end):
+        """
+        Returns the part of a series with the samples between start and
+        end.
+        """
+        series_start, interval, values = series
+        interval_usecs = interval * 1000000
+        first = max(0, -(-(start - series_start) // interval_usecs))
+        last = max(first, -(-(end - series_start) // interval_usecs))
+        return (series_start + first * interval_usecs, interval,
+                values[first:last])
+
+    def join_series(self, series_list, start, end):
+        """
+        Join the samples between start and end of several series of the
+        same stat in a single series, None if all of them are None.
+
+        Series of consecutive blocks are usually contiguous and are just
+        concatenated. Otherwise samples are laid out by time over the
+        shortest interval, samples missing in between are -1 like in
+        arithmos.
+        """
+        series_list = sorted(series for series in series_list if series)
+        if not series_list:
+            return None
+        interval = series_list[0][1]
+        interval_usecs = interval * 1000000
+        series_start, values = series_list[0][0], []
+        contiguous = True
+        for piece_start, piece_interval, piece_values in series_list:
+            if (piece_interval != interval or piece_start !=
+                    series_start + len(values) * interval_usecs):
+                contiguous = False
+                break
+            values.extend(piece_values)
+        if contiguous:
+            return self.slice_series((series_start, interval, values),
+                                     start, end)
+
+        interval = min(series[1] for series in series_list)
+        interval_usecs = interval * 1000000
+        series_start = series_list[0][0]
+        first = max(0, -(-(start - series_start) // interval_usecs))
+        series_start += first * interval_usecs
+        values = [-1] * max(0, -(-(end - series_start) // interval_usecs))
+        for piece_start, piece_interval, piece_values in series_list:
+            for i, value in enumerate(piece_values):
+                index = ((piece_start + i * piece_interval * 1000000 -
+                          series_start) // interval_usecs)
+                if 0 <= index < len(values):
+                    values[index] = value
+        return series_start, interval, values
+
+    def get(self, entity_type, request_list, start, end, sampling_interval):
+        """
+        Get a list of (entity_id, stat) tuples and the start and end of a
+        span returned by cacheable_span(). Returns a dictionary keyed by
+        the tuple with the series between start and end of every tuple
+        cached in all the blocks of the span.
+        """
+        pieces = dict((request, []) for request in request_list)
+        for block_start in self._blocks(start, end):
+            segment = self._read_segment(self._segment_path(
+                entity_type, sampling_interval, block_start))
+            for request in list(pieces):
+                series = segment.get(self._series_key(*request))
+                if series is None:
+                    del pieces[request]
+                else:
+                    pieces[request].append(series)
+            if not pieces:
+                break
+        return dict((request, self.join_series(series_list, start, end))
+                    for request, series_list in pieces.items())
+
+    def put(self, entity_type, series_dict, start, end, sampling_interval):
+        """
+        Store a dictionary of series between the start and end of a span
+        returned by cacheable_span(), keyed by (entity_id, stat) tuples.
+        Series are split in blocks and merged with the series already
+        cached for every block.
+        """
+        if not series_dict:
+            return
+        written = False
+        for block_start in self._blocks(start, end):
+            path = self._segment_path(entity_type, sampling_interval,
+                                      block_start)
+            segment = self._read_segment(path)
+            for (entity_id, stat), series in series_dict.items():
+                segment[self._series_key(entity_id, stat)] = \
+                    self.slice_series(series, block_start,
+                                      block_start + self.block_usecs)
+            written = self._write_segment(path, segment) or written
+        if written:
+            self._evict()
+
+# ========================================================================
+
+
+class TimeRangeAggregator(object):
+    """
+    Aggregates the samples of time range series returned by arithmos in
+    intervals (buckets) of a fixed length.
+
+    Series are (start_usecs, sampling_interval_secs, value_list) tuples as
+    returned by Reporter._iter_time_range_stats(), or None for failed
+    requests. Arithmos returns -1 when there is no data for a sample, so
+    samples lower than zero are masked and don't count for any aggregate.
+    Intervals without valid samples aggregate to -1.
+
+    Supported aggregates are the ones in AGGREGATES: mean, min, max, last
+    (most recent valid sample) and percentiles pNN, interpolated linearly
+    between the closest samples.
+
+    When NumPy is available every series and interval is aggregated at
+    once over flat arrays, otherwise it falls back to pure Python.
+    """
+
+    AGGREGATES = ["mean", "min", "max", "last", "p50", "p90", "p95", "p99"]
+
+    def __init__(self, agg="mean"):
+        if agg not in self.AGGREGATES:
+            raise ValueError("Invalid aggregate: {}".format(agg))
+        self.agg = agg
+        self.numpy = _import_optional("numpy")
+
+    def aggregate(self, series_list, start, bucket_usecs, num_buckets,
+                  divisors=None):
+        """
+        Returns a list with a list of num_buckets aggregated values for
+        every series in series_list. Buckets are bucket_usecs long and
+        begin at start (usecs), samples outside the buckets are ignored.
+
+        divisors is an optional list with a unit divisor per series, the
+        aggregated values of every series are divided by it. Intervals
+        without data stay at -1.
+        """
+        if self.numpy is not None:
+            return self._aggregate_numpy(series_list, start, bucket_usecs,
+                                         num_buckets, divisors)
+        ret = []
+        for i, series in enumerate(series_list):
+            values = [self._aggregate_values(bucket_values)
+                      for bucket_values in self._series_buckets(
+                          series, start, bucket_usecs, num_buckets)]
+            divisor = divisors[i] if divisors else 1
+            if divisor != 1:
+                values = [value / divisor if value >= 0 else -1
+                          for value in values]
+            ret.append(values)
+        return ret
+
+    def _series_buckets(self, series, start, bucket_usecs, num_buckets):
+        """
+        Split the valid samples of a series in buckets.
+        """
+        buckets = [[] for _ in range(num_buckets)]
+        if series:
+            series_start, interval, values = series
+            interval_usecs = interval * 1000000
+            for i, value in enumerate(values):
+                bucket = (series_start + i * interval_usecs - start) \
+                    // bucket_usecs
+                if value >= 0 and 0 <= bucket < num_buckets:
+                    buckets[bucket].append(value)
+        return buckets
+
+    def _aggregate_values(self, values):
+        if not values:
+            return -1
+        if self.agg == "mean":
+            return sum(values) / len(values)
+        if self.agg == "min":
+            return min(values)
+        if self.agg == "max":
+            return max(values)
+        if self.agg == "last":
+            return values[-1]
+
+        values = sorted(values)
+        position = (len(values) - 1) * float(self.agg[1:]) / 100
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return (values[lower] +
+                (values[upper] - values[lower]) * (position - lower))
+
+    def _aggregate_numpy(self, series_list, start, bucket_usecs, num_buckets,
+                         divisors=None):
+        """
+        Samples of all series are laid out in flat arrays together with the
+        group (series and bucket) they belong to. Groups are aggregated with
+        bincount and with a single sort by group, no Python code runs per
+        sample.
+        """
+        numpy = self.numpy
+        num_groups = len(series_list) * num_buckets
+        values_chunks = []
+        groups_chunks = []
+        for i, series in enumerate(series_list):
+            if not series:
+                continue
+            series_start, interval, values = series
+            values = numpy.asarray(values, dtype=numpy.float64)
+            buckets = ((series_start - start +
+                        numpy.arange(len(values), dtype=numpy.int64) *
+                        (interval * 1000000)) // bucket_usecs)
+            valid = (values >= 0) & (buckets >= 0) & (buckets < num_buckets)
+            values_chunks.append(values[valid])
+            groups_chunks.append(buckets[valid] + i * num_buckets)
+
+        ret = numpy.full(num_groups, -1.0)
+        if values_chunks:
+            values = numpy.concatenate(values_chunks)
+            groups = numpy.concatenate(groups_chunks)
+        else:
+            values = numpy.zeros(0)
+            groups = numpy.zeros(0, dtype=numpy.int64)
+        counts = numpy.bincount(groups, minlength=num_groups)
+        has_data = counts > 0
+
+        if self.agg == "mean":
+            sums = numpy.bincount(groups, weights=values, minlength=num_groups)
+            ret[has_data] = sums[has_data] / counts[has_data]
+        else:
+            # Samples of every group are contiguous after sorting by group,
+            # 'first' is the position of the first sample of every group.
+            first = numpy.cumsum(counts) - counts
+            last = first + counts - 1
+            if self.agg == "last":
+                # Stable sort by group keeps samples in time order.
+                order = numpy.argsort(groups, kind="mergesort")
+                sorted_values = values[order]
+                ret[has_data] = sorted_values[last[has_data]]
+            else:
+                order = numpy.lexsort((values, groups))
+                sorted_values = values[order]
+                if self.agg == "min":
+                    ret[has_data] = sorted_values[first[has_data]]
+                elif self.agg == "max":
+                    ret[has_data] = sorted_values[last[has_data]]
+                else:
+                    position = (first + (counts - 1) *
+                                float(self.agg[1:]) / 100)[has_data]
+                    lower = numpy.floor(position).astype(numpy.int64)
+                    upper = numpy.minimum(lower + 1, last[has_data])
+                    ret[has_data] = (
+                        sorted_values[lower] +
+                        (sorted_values[upper] - sorted_values[lower]) *
+                        (position - lower))
+
+        ret = ret.reshape(len(series_list), num_buckets)
+        if divisors:
+            ret = numpy.where(
+                ret >= 0,
+                ret / numpy.asarray(divisors, dtype=numpy.float64)[:, None],
+                -1)
+        return ret.tolist()
+
+# ========================================================================
+
+
+class EntityRow(object):
+    """
+    Row of an EntityTable. Rows are views, they don't hold values, and
+    behave like the entity dictionaries they replace: row[key],
+    row.get(key), key in row, iteration over keys, keys() and items().
+    """
+
+    __slots__ = ("table", "i")
+
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    def __getitem__(self, key):
+        return self.table.columns[self.table.index[key]][self.i]
+
+    def __setitem__(self, key, value):
+        self.table.set_value(self.i, key, value)
+
+    def __contains__(self, key):
+        return key in self.table.index
+
+    def __iter__(self):
+        return iter(self.table.keys)
+
+    def __len__(self):
+        return len(self.table.keys)
+
+    def get(self, key, default=None):
+        column = self.table.index.get(key)
+        if column is None:
+            return default
+        return self.table.columns[column][self.i]
+
+    def keys(self):
+        return list(self.table.keys)
+
+    def items(self):
+        return [(key, column[self.i])
+                for key, column in zip(self.table.keys, self.table.columns)]
+
+    def __repr__(self):
+        return "EntityRow({!r})".format(dict(self.items()))
+
+
+class EntityTable(object):
+    """
+    Compact report result: the entities of a report stored column by
+    column with a schema (list of keys) shared by all of them.
+
+    Integer and float columns are typed arrays, 8 bytes per value instead
+    of a Python object per value plus a dictionary per entity. Other
+    columns (names, ids) are lists. Indexing and iterating the table
+    yields EntityRow views, so UIs, sorting and the exporter use tables
+    the same way they used lists of dictionaries.
+    """
+
+    def __init__(self, keys, columns):
+        self.keys = list(keys)
+        self.columns = list(columns)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        self.size = len(self.columns[0]) if self.columns else 0
+
+    @staticmethod
+    def pack(values):
+        """
+        Returns values as a typed array when they are all integers or all
+        numbers, as a list otherwise.
+        """
+        classes = set(value.__class__ for value in values)
+        if classes and classes <= set(INTEGER_TYPES):
+            try:
+                return array.array("l", values)
+            except OverflowError:
+                return list(values)
+        if classes and classes <= set(NUMBER_TYPES):
+            return array.array("d", values)
+        return list(values)
+
+    @classmethod
+    def from_dicts(cls, entities):
+        """
+        Build a table from a list of entity dictionaries, with the keys of
+        the first one. Keys missing in other entities are -1.
+        """
+        keys = list(entities[0]) if entities else []
+        return cls(keys, [cls.pack([entity.get(key, -1)
+                                    for entity in entities])
+                          for key in keys])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("EntityTable index out of range")
+        return EntityRow(self, i)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield EntityRow(self, i)
+
+    def column(self, key):
+        return self.columns[self.index[key]]
+
+    def set_value(self, i, key, value):
+        """
+        Set the value of key for row i. A new key adds a column of -1 to
+        the schema, a value that doesn't fit a typed column turns it into a
+        list.
+        """
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.columns.append([-1] * self.size)
+        column = self.index[key]
+        try:
+            self.columns[column][i] = value
+        except TypeError:
+            self.columns[column] = list(self.columns[column])
+            self.columns[column][i] = value
+
+    def set_column(self, key, column):
+        """
+        Replace the column key, or add it to the schema when it's new.
+        """
+        if key in self.index:
+            self.columns[self.index[key]] = column
+        else:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.columns.append(column)
+
+    def take(self, rows):
+        """
+        Returns a new table with the rows in the list of row numbers rows.
+        """
+        columns = []
+        for column in self.columns:
+            values = [column[i] for i in rows]
+            if isinstance(column, array.array):
+                values = array.array(column.typecode, values)
+            columns.append(values)
+        return EntityTable(self.keys, columns)
+
+    def sorted(self, key, reverse=False, limit=None):
+        """
+        Returns a new table with the rows sorted by the column key, the
+        sort is stable like sorted(). With limit only the first limit rows
+        are kept, they are picked with a heap instead of sorting the whole
+        table.
+        """
+        if not self.size:
+            return self
+        sort_key = self.column(key).__getitem__
+        if limit is not None and limit < self.size:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return self.take(select(limit, range(self.size), key=sort_key))
+        return self.take(sorted(range(self.size), key=sort_key,
+                                reverse=reverse))
+
+    def filter(self, key, value):
+        """
+        Returns a new table with the rows where key is value.
+        """
+        if not self.size:
+            return self
+        return self.take([i for i, row_value in enumerate(self.column(key))
+                          if row_value == value])
+
+# ========================================================================
+
+
+class ReportSnapshot(object):
+    """
+    Columnar snapshot of the results of a report, written with --save and
+    rendered again with --load without querying arithmos.
+
+    Reports return one list of entity dictionaries per interval (frame).
+    A snapshot stores every frame column by column: one typed array per
+    stat and a dictionary of strings for text fields like entity names and
+    ids, which are stored as indexes into it. The file begins with a JSON
+    header holding the CLI fields of the report and the sort conversion of
+    its reporter, followed by one zlib compressed block per frame:
+
+      +-------+----------------+--------+------------------------------+
+      | magic | header length  | header | block length | frame block  |
+      +-------+----------------+--------+------------------------------+
+                                        |  ... one block per frame ... |
+
+      frame block: meta length, meta (time, rows, columns, strings),
+                   column arrays
+
+    Frames are appended as they are reported, so an interrupted live report
+    still leaves a valid snapshot. Loaded frames are kept as arrays and
+    only turned into dictionaries, with the fields to be displayed, when
+    they are rendered.
+    """
+
+    MAGIC = b"NARFSNAP"
+    VERSION = 1
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, path):
+        _import_serialization()
+        self.path = path
+        self.header = None
+        self.frames = []
+        self._file = None
+
+    def _pack_column(self, values):
+        """
+        Returns (typecode, array) for a list of values. Integers are stored
+        as 'l', other numbers as 'd' and everything else as 'i' indexes
+        into the list of strings of the frame, with typecode "s".
+        """
+        if all(isinstance(value, numbers.Integral) for value in values):
+            try:
+                return "l", array.array("l", values)
+            except OverflowError:
+                pass
+        if all(isinstance(value, numbers.Real) for value in values):
+            return "d", array.array("d", values)
+        return "s", array.array("i", [0] * len(values))
+
+    def open(self, field_list, sort_conversion, default_sort_field="name"):
+        """
+        Create the snapshot file and write the header.
+        """
+        self.header = {
+            "version": self.VERSION,
+            "byteorder": sys.byteorder,
+            "fields": field_list,
+            "sort_conversion": sort_conversion,
+            "default_sort_field": default_sort_field
+        }
+        header = json.dumps(self.header).encode("utf-8")
+        self._file = open(self.path, "wb")
+        self._file.write(self.MAGIC)
+        self._file.write(self._LENGTH.pack(len(header)))
+        self._file.write(header)
+
+    def add_frame(self, str_time, entity_list):
+        """
+        Append a frame with the list of entity dictionaries reported at
+        str_time.
+        """
+        if isinstance(entity_list, EntityTable):
+            keys = sorted(entity_list.keys)
+        else:
+            keys = sorted(set(key for entity in entity_list
+                              for key in entity))
+        strings = []
+        string_index = {}
+        columns = []
+        chunks = []
+        for key in keys:
+            if isinstance(entity_list, EntityTable):
+                values = entity_list.column(key)
+            else:
+                values = [entity.get(key, -1) for entity in entity_list]
+            if isinstance(values, array.array) and values.typecode in "ld":
+                typecode, column = values.typecode, values
+            else:
+                typecode, column = self._pack_column(values)
+            if typecode == "s":
+                for i, value in enumerate(values):
+                    value = value if isinstance(value, type(u"")) \
+                        else str(value)
+                    if value not in string_index:
+                        string_index[value] = len(strings)
+                        strings.append(value)
+                    column[i] = string_index[value]
+            columns.append([key, typecode])
+            if hasattr(column, "tobytes"):
+                chunks.append(column.tobytes())
+            else:
+                chunks.append(column.tostring())
+
+        meta = json.dumps({
+            "time": str_time,
+            "rows": len(entity_list),
+            "columns": columns,
+            "strings": strings
+        }).encode("utf-8")
+        block = zlib.compress(self._LENGTH.pack(len(meta)) + meta +
+                              b"".join(chunks))
+        self._file.write(self._LENGTH.pack(len(block)))
+        self._file.write(block)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def load(self):
+        """
+        Read the header and every frame of the snapshot file. Raises
+        ValueError if the file is not a valid snapshot.
+        """
+        with open(self.path, "rb") as snapshot_file:
+            data = snapshot_file.read()
+        if data[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("{} is not a narf snapshot".format(self.path))
+        try:
+            offset = len(self.MAGIC)
+            length, = self._LENGTH.unpack_from(data, offset)
+            offset += self._LENGTH.size
+            self.header = json.loads(
+                data[offset:offset + length].decode("utf-8"))
+            offset += length
+            if self.header["version"] != self.VERSION:
+                raise ValueError("Unsupported snapshot version {}".format(
+                    self.header["version"]))
+            swap = self.header["byteorder"] != sys.byteorder
+
+            self.frames = []
+            while offset < len(data):
+                length, = self._LENGTH.unpack_from(data, offset)
+                offset += self._LENGTH.size
+                block = zlib.decompress(data[offset:offset + length])
+                offset += length
+                self.frames.append(self._load_frame(block, swap))
+        except (KeyError, struct.error, zlib.error) as e:
+            raise ValueError("Corrupted snapshot {}: {}".format(self.path, e))
+        return self
+
+    def _load_frame(self, block, swap):
+        length, = self._LENGTH.unpack_from(block)
+        offset = self._LENGTH.size
+        meta = json.loads(block[offset:offset + length].decode("utf-8"))
+        offset += length
+        columns = {}
+        for key, typecode in meta["columns"]:
+            column = array.array("i" if typecode == "s" else typecode)
+            size = column.itemsize * meta["rows"]
+            if hasattr(column, "frombytes"):
+                column.frombytes(block[offset:offset + size])
+            else:
+                column.fromstring(block[offset:offset + size])
+            offset += size
+            if swap:
+                column.byteswap()
+            columns[key] = (typecode, column)
+        return meta["time"], meta["rows"], columns, meta["strings"]
+
+    def _column_getter(self, column, strings):
+        typecode, values = column
+        if typecode == "s":
+            return lambda i: strings[values[i]]
+        return values.__getitem__
+
+    def frame_rows(self, frame, sort="name"):
+        """
+        Returns an EntityTable for a frame, with the fields in the header,
+        sorted like Reporter._sort_entity_dict() does.
+        """
+        str_time, rows, columns, strings = frame
+        sort_conversion = self.header["sort_conversion"]
+        default_sort_by = sort_conversion[self.header["default_sort_field"]]
+        sort_by = sort_conversion.get(sort, default_sort_by)
+        if sort_by not in columns:
+            sort_by = default_sort_by
+
+        order = range(rows)
+        if sort_by in columns:
+            order = sorted(order,
+                           key=self._column_getter(columns[sort_by], strings),
+                           reverse=sort_by != default_sort_by)
+
+        keys = [field["key"] for field in self.header["fields"]
+                if field["key"] in columns]
+        table_columns = []
+        for key in keys:
+            typecode, values = columns[key]
+            if typecode == "s":
+                table_columns.append([strings[values[i]] for i in order])
+            else:
+                table_columns.append(array.array(typecode,
+                                                 [values[i] for i in order]))
+        return EntityTable(keys, table_columns)
+
+# ========================================================================
+
+
+class ArithmosDataSource(object):
+    """
+    Datasource for reporters, it sends MasterGetEntitiesStats and
+    MasterGetTimeRangeStats queries to arithmos.
+
+    A datasource implements get_entities_stats() and
+    get_time_range_stats(), reporters don't talk to arithmos directly, so
+    they can run against a recording with ReplayDataSource instead.
+
+    All the reporters of a Ui share one datasource. Connections to arithmos
+    are opened on first use, so creating it costs nothing until a report
+    runs.
+    """
+
+    def __init__(self):
+        _import_arithmos()
+        self._interfaces = None
+        self._arithmos_interface = None
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+
+    @property
+    def arithmos_interface(self):
+        with self._lock:
+            if self._arithmos_interface is None:
+                from serviceability.interface.analytics.arithmos_rpc_client \
+                    import ArithmosDataProcessing
+                self._arithmos_interface = ArithmosDataProcessing()
+        return self._arithmos_interface
+
+    def _get_arithmos_client(self):
+        """
+        RPC clients are not shared between threads, the first thread
+        querying arithmos uses the client of the shared interfaces and every
+        worker of the reporters pool gets its own.
+        """
+        if not hasattr(self._thread_local, "arithmos_client"):
+            from util.interfaces.interfaces import NutanixInterfaces
+            with self._lock:
+                if self._interfaces is None:
+                    self._interfaces = NutanixInterfaces()
+                    client = self._interfaces.arithmos_client
+                else:
+                    client = NutanixInterfaces().arithmos_client
+            self._thread_local.arithmos_client = client
+        return self._thread_local.arithmos_client
+
+    def get_entities_stats(self, entity_type, sort_criteria=None,
+                           filter_criteria=None, search_term=None,
+                           field_name_list=None):
+        """
+        Returns the MasterGetEntitiesStats response, None if the call
+        failed.
+        """
+        ret = self.arithmos_interface.MasterGetEntitiesStats(
+            entity_type, sort_criteria, filter_criteria, search_term,
+            requested_field_name_list=field_name_list)
+        if ret:
+            return ret.response
+
+    def get_time_range_stats(self, entity_type, batch, start, end,
+                             sampling_interval):
+        """
+        Query arithmos for a batch of (entity_id, stat) tuples in a single
+        MasterGetTimeRangeStats RPC. Returns a list with a (start_usecs,
+        sampling_interval_secs, value_list) tuple per request or None when
+        arithmos returned an error for that request.
+
+        Returns None when the RPC itself fails, like ArithmosDataProcessing
+        does, so a failed batch doesn't abort the whole report.
+        """
+        arg = MasterGetTimeRangeStatsArg()
+        for entity_id, stat in batch:
+            request = arg.request_list.add()
+            request.entity_type = entity_type
+            request.entity_id = entity_id
+            request.field_name = stat
+            request.start_time_usecs = start
+            request.end_time_usecs = end
+            request.sampling_interval_secs = sampling_interval
+
+        try:
+            resp = self._get_arithmos_client().MasterGetTimeRangeStats(arg)
+        except Exception as e:
+            sys.stderr.write(
+                "WARNING: MasterGetTimeRangeStats failed for {} requests: "
+                "{}\n".format(len(batch), e))
+            return None
+        batch_series = [None] * len(batch)
+        if resp:
+            for i, res in enumerate(resp.response_list[:len(batch)]):
+                if res.error == ArithmosErrorProto.kNoError:
+                    stat = res.time_range_stat
+                    batch_series[i] = (
+                        stat.start_time_usecs or start,
+                        stat.sampling_interval_secs or sampling_interval,
+                        stat.value_list)
+        return batch_series
+
+    def close(self):
+        pass
+
+
+class ReplayError(Exception):
+    pass
+
+
+class DataSourceRecording(object):
+    """
+    File with the arithmos responses captured by RecordingDataSource:
+
+      +-------+---------------+--------+------------------------------+
+      | magic | header length | header | block length | record block |
+      +-------+---------------+--------+------------------------------+
+                                       | ... one block per response ...|
+
+      record block (zlib): meta length, meta (JSON), payload
+
+    MasterGetEntitiesStats records hold the query in meta and the
+    serialized response proto as payload. MasterGetTimeRangeStats records
+    hold the requests of a batch and the series returned for them in meta,
+    without payload. Records are appended as responses arrive, so an
+    interrupted session still leaves a valid recording.
+    """
+
+    MAGIC = b"NARFREC"
+    VERSION = 1
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, path):
+        _import_serialization()
+        self.path = path
+        self._file = None
+
+    def open(self):
+        header = json.dumps({"version": self.VERSION}).encode("utf-8")
+        self._file = open(self.path, "wb")
+        self._file.write(self.MAGIC)
+        self._file.write(self._LENGTH.pack(len(header)))
+        self._file.write(header)
+        self._file.flush()
+
+    def add_record(self, meta, payload=b""):
+        meta = json.dumps(meta).encode("utf-8")
+        block = zlib.compress(self._LENGTH.pack(len(meta)) + meta + payload)
+        self._file.write(self._LENGTH.pack(len(block)) + block)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def records(self):
+        """
+        Yields (meta, payload) for every record in the file. Raises
+        ValueError if the file is not a valid recording.
+        """
+        with open(self.path, "rb") as recording_file:
+            data = recording_file.read()
+        if data[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("{} is not a narf recording".format(self.path))
+        try:
+            offset = len(self.MAGIC)
+            length, = self._LENGTH.unpack_from(data, offset)
+            offset += self._LENGTH.size
+            header = json.loads(data[offset:offset + length].decode("utf-8"))
+            offset += length
+            if header["version"] != self.VERSION:
+                raise ValueError("Unsupported recording version {}".format(
+                    header["version"]))
+            while offset < len(data):
+                length, = self._LENGTH.unpack_from(data, offset)
+                offset += self._LENGTH.size
+                block = zlib.decompress(data[offset:offset + length])
+                offset += length
+                meta_length, = self._LENGTH.unpack_from(block)
+                meta = json.loads(block[self._LENGTH.size:
+                                        self._LENGTH.size + meta_length]
+                                  .decode("utf-8"))
+                yield meta, block[self._LENGTH.size + meta_length:]
+        except (KeyError, struct.error, zlib.error) as e:
+            raise ValueError("Corrupted recording {}: {}".format(self.path, e))
+
+
+def _entities_stats_query_key(entity_type, sort_criteria, filter_criteria,
+                              search_term, field_name_list):
+    return json.dumps([entity_type, sort_criteria, filter_criteria,
+                       search_term, list(field_name_list or [])])
+
+
+def _time_range_request_key(entity_type, entity_id, stat, start, end,
+                            sampling_interval):
+    return "{}|{}|{}|{}|{}|{}".format(entity_type, entity_id, stat,
+                                      start, end, sampling_interval)
+
+
+class RecordingDataSource(object):
+    """
+    Wraps a datasource and captures every response to a recording file
+    (--record) that can be served back later with ReplayDataSource.
+    """
+
+    def __init__(self, datasource, path):
+        self.datasource = datasource
+        self.recording = DataSourceRecording(path)
+        self.recording.open()
+        self._lock = threading.Lock()
+
+    def get_entities_stats(self, entity_type, sort_criteria=None,
+                           filter_criteria=None, search_term=None,
+                           field_name_list=None):
+        response = self.datasource.get_entities_stats(
+            entity_type, sort_criteria, filter_criteria, search_term,
+            field_name_list)
+        if response is not None:
+            meta = {
+                "type": "entities",
+                "key": _entities_stats_query_key(
+                    entity_type, sort_criteria, filter_criteria,
+                    search_term, field_name_list),
+                "proto": response.DESCRIPTOR.full_name
+            }
+            with self._lock:
+                self.recording.add_record(meta, response.SerializeToString())
+        return response
+
+    def get_time_range_stats(self, entity_type, batch, start, end,
+                             sampling_interval):
+        batch_series = self.datasource.get_time_range_stats(
+            entity_type, batch, start, end, sampling_interval)
+        if batch_series is None:
+            # Failed RPCs are not recorded, replaying them fails the same
+            # way since the requests are missing.
+            return None
+        meta = {
+            "type": "time_range",
+            "keys": [_time_range_request_key(entity_type, entity_id, stat,
+                                             start, end, sampling_interval)
+                     for entity_id, stat in batch],
+            "series": [[series[0], series[1], list(series[2])]
+                       if series else None for series in batch_series]
+        }
+        with self._lock:
+            self.recording.add_record(meta)
+        return batch_series
+
+    def close(self):
+        self.recording.close()
+
+
+class ReplayDataSource(object):
+    """
+    Serve the responses of a recording made with --record, without
+    connecting to arithmos.
+
+    Live queries are matched by entity type, sort and filter criteria,
+    search term and fields. When the same query was recorded several times
+    responses are served in the recorded order, starting over after the
+    last one, so live reports and the interactive UI keep refreshing.
+    Time range requests are matched by entity, stat and window, requests
+    missing in the recording are returned as failed (None).
+    """
+
+    def __init__(self, path):
+        # Responses are parsed with the protos registered in the
+        # symbol database.
+        _import_arithmos()
+        self.path = path
+        self.entities = {}
+        self.time_range = {}
+        self._next = {}
+        self._lock = threading.Lock()
+        for meta, payload in DataSourceRecording(path).records():
+            if meta["type"] == "entities":
+                self.entities.setdefault(meta["key"], []).append(
+                    (meta["proto"], payload))
+            elif meta["type"] == "time_range":
+                for key, series in zip(meta["keys"], meta["series"]):
+                    self.time_range[key] = tuple(series) if series else None
+
+    def get_entities_stats(self, entity_type, sort_criteria=None,
+                           filter_criteria=None, search_term=None,
+                           field_name_list=None):
+        key = _entities_stats_query_key(entity_type, sort_criteria,
+                                        filter_criteria, search_term,
+                                        field_name_list)
+        responses = self.entities.get(key)
+        if not responses:
+            raise ReplayError(
+                "No recorded response in {} for entity type {}, sort {}, "
+                "filter {!r}".format(self.path, entity_type, sort_criteria,
+                                     filter_criteria))
+        with self._lock:
+            i = self._next.get(key, 0)
+            self._next[key] = (i + 1) % len(responses)
+        proto_name, payload = responses[i]
+        response = symbol_database.Default().GetSymbol(proto_name)()
+        response.ParseFromString(payload)
+        return response
+
+    def get_time_range_stats(self, entity_type, batch, start, end,
+                             sampling_interval):
+        return [self.time_range.get(_time_range_request_key(
+                    entity_type, entity_id, stat, start, end,
+                    sampling_interval))
+                for entity_id, stat in batch]
+
+    def close(self):
+        pass
+
+
+class _SyntheticMessage(object):
+    """
+    Stand-in for arithmos protobuf messages used by SyntheticDataSource,
+    fields are attributes and DESCRIPTOR.fields/ListFields() list them like
+    in a protobuf message.
+    """
+
+    class _Field(object):
+        def __init__(self, name):
+            self.name = name
+
+    class _Descriptor(object):
+        def __init__(self, fields):
+            self.fields = fields
+
+    # Messages with the same fields share their descriptor, like messages
+    # of the same protobuf type.
+    _descriptors = {}
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+        names = tuple(sorted(fields))
+        descriptor = self._descriptors.get(names)
+        if descriptor is None:
+            descriptor = self._descriptors[names] = self._Descriptor(
+                [self._Field(name) for name in names])
+        self.DESCRIPTOR = descriptor
+
+    def ListFields(self):
+        return [(field, getattr(self, field.name))
+                for field in self.DESCRIPTOR.fields]
+
+
+class SyntheticDataSource(object):
+    """
+    Synthetic arithmos for --benchmark: a cluster of num_nodes nodes,
+    num_vms VMs and num_vgs volume groups, every time range stat returns
+    num_samples samples. Every RPC sleeps latency_ms to simulate arithmos
+    response time.
+
+    Entities and samples are generated once from a fixed seed, so runs are
+    reproducible and generating data doesn't count in the measurements.
+    Live queries cycle through a few variants of the stats so consecutive
+    refreshes don't return the same values.
+    """
+
+    VARIANTS = 3
+    SAMPLE_POOL = 64
+
+    def __init__(self, num_nodes=4, num_vms=200, num_vgs=20, num_samples=120,
+                 latency_ms=0, seed=0):
+        import random
+        _import_arithmos()
+        _import_serialization()
+        self.num_samples = max(1, num_samples)
+        self.latency = latency_ms / 1000
+        self.rpcs = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+        self.stat_names = sorted(set(
+            field for fields in (NODES_OVERALL_REPORT_ARITHMOS_FIELDS,
+                                 NODES_IOPS_REPORT_ARITHMOS_FIELDS,
+                                 NODES_BANDWIDTH_REPORT_ARITHMOS_FIELDS,
+                                 NODES_LATENCY_REPORT_ARITHMOS_FIELDS,
+                                 VM_OVERALL_REPORT_ARITHMOS_FIELDS,
+                                 VM_IOPS_REPORT_ARITHMOS_FIELDS,
+                                 VG_OVERALL_REPORT_ARITHMOS_FIELDS)
+            for field in fields
+            if not field.endswith("_name") and field != "id"))
+
+        node_names = ["node-{:03d}".format(i) for i in range(num_nodes)]
+        self.entities = {
+            ArithmosEntityProto.kCluster: [
+                [_SyntheticMessage(id="0", cluster_name="synthetic")]
+                for _ in range(self.VARIANTS)],
+            ArithmosEntityProto.kNode: [
+                [self._entity(str(i), node_name=name)
+                 for i, name in enumerate(node_names)]
+                for _ in range(self.VARIANTS)],
+            ArithmosEntityProto.kVM: [
+                [self._entity("vm-{:05d}".format(i),
+                              node_name=node_names[i % len(node_names)]
+                              if node_names else "-",
+                              vm_name="vm-{:05d}".format(i))
+                 for i in range(num_vms)]
+                for _ in range(self.VARIANTS)],
+            ArithmosEntityProto.kVolumeGroup: [
+                [self._entity("vg-{:04d}".format(i),
+                              volume_group_name="vg-{:04d}".format(i))
+                 for i in range(num_vgs)]
+                for _ in range(self.VARIANTS)]
+        }
+        self.entity_lists = {
+            ArithmosEntityProto.kCluster: "cluster",
+            ArithmosEntityProto.kNode: "node",
+            ArithmosEntityProto.kVM: "vm",
+            ArithmosEntityProto.kVolumeGroup: "volume_group"
+        }
+        self._next = dict((entity_type, 0) for entity_type in self.entities)
+        self.sample_pool = [[self._stat_value("num_iops")
+                             for _ in range(self.num_samples)]
+                            for _ in range(self.SAMPLE_POOL)]
+
+    def _stat_value(self, stat):
+        if self._random.random() < 0.05:
+            return -1
+        if "ppm" in stat:
+            return self._random.randint(0, 1000000)
+        if "kBps" in stat:
+            return self._random.randint(0, 500000)
+        if "usecs" in stat:
+            return self._random.randint(100, 20000)
+        if stat == "num_virtual_disks":
+            return self._random.randint(1, 10)
+        return self._random.randint(0, 5000)
+
+    def _entity(self, entity_id, node_name=None, **names):
+        """
+        Stats with a dot in the name are generic stats in arithmos, the
+        others are fields of common_stats.
+        """
+        stats = _SyntheticMessage(
+            common_stats=_SyntheticMessage(**dict(
+                (stat, self._stat_value(stat))
+                for stat in self.stat_names if "." not in stat)),
+            generic_stat_list=[
+                _SyntheticMessage(stat_name=stat,
+                                  stat_value=self._stat_value(stat))
+                for stat in self.stat_names if "." in stat])
+        attributes = []
+        if node_name is not None:
+            names["node_name"] = node_name
+            attributes.append(_SyntheticMessage(
+                attribute_name="node_name", attribute_value_str=node_name))
+        return _SyntheticMessage(id=entity_id, stats=stats,
+                                 generic_attribute_list=attributes, **names)
+
+    def _rpc(self):
+        with self._lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_entities_stats(self, entity_type, sort_criteria=None,
+                           filter_criteria=None, search_term=None,
+                           field_name_list=None):
+        self._rpc()
+        with self._lock:
+            variant = self._next[entity_type]
+            self._next[entity_type] = (variant + 1) % self.VARIANTS
+        entities = self.entities[entity_type][variant]
+
+        node_names = [term[len("node_name=="):]
+                      for term in (filter_criteria or "").replace(
+                          ";", ",").split(",")
+                      if term.startswith("node_name==")]
+        if node_names:
+            entities = [entity for entity in entities
+                        if getattr(entity, "node_name", None) in node_names]
+
+        entity_list = _SyntheticMessage(
+            **dict((name, []) for name in self.entity_lists.values()))
+        setattr(entity_list, self.entity_lists[entity_type], entities)
+        return _SyntheticMessage(error=ArithmosErrorProto.kNoError,
+                                 entity_list=entity_list)
+
+    def get_time_range_stats(self, entity_type, batch, start, end,
+                             sampling_interval):
+        self._rpc()
+        interval = max(1, (end - start) // 1000000 // self.num_samples)
+        return [(start, interval, self.sample_pool[
+                    zlib.crc32("{}|{}".format(entity_id, stat).encode("utf-8"))
+                    % self.SAMPLE_POOL])
+                for entity_id, stat in batch]
+
+    def close(self):
+        pass
+
+# ========================================================================
+
+
+class RpcStats(object):
+    """
+    Instrumentation of the queries sent by reporters and of the time spent
+    by narf, printed at exit with --stats.
+
+    Every query made through the datasource is recorded with its duration,
+    entity type, stats, number of entities and samples and payload size.
+    The payload size is the size of the response for live queries, time
+    range responses are counted as 8 bytes per sample. Failed queries are
+    counted as errors.
+
+    Time is also accounted in phases: "fetch" (waiting for arithmos or the
+    cache), "conversion" (turning responses into report rows) and
+    "format" (printing and rendering). Phases can be nested, the time of a
+    phase doesn't include the time of the phases running inside it, e.g.
+    the fetch of a report is not accounted as conversion.
+    """
+
+    PHASES = ["fetch", "conversion", "format"]
+
+    def __init__(self):
+        self.calls = {}
+        self.phases = dict((phase, 0.0) for phase in self.PHASES)
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+
+    def record(self, rpc, entity_type, stat_list, entities, samples,
+               payload_bytes, duration, error=False):
+        with self._lock:
+            call = self.calls.setdefault((rpc, entity_type), {
+                "durations": [], "stats": set(), "entities": 0,
+                "samples": 0, "bytes": 0, "errors": 0})
+            call["durations"].append(duration)
+            call["stats"].update(stat_list)
+            call["entities"] += entities
+            call["samples"] += samples
+            call["bytes"] += payload_bytes
+            if error:
+                call["errors"] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        stack = getattr(self._thread_local, "stack", None)
+        if stack is None:
+            stack = self._thread_local.stack = []
+        # Time of nested phases is accumulated in the last element of the
+        # stack and discounted when the outer phase finishes.
+        stack.append(0.0)
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            elapsed = timeit.default_timer() - start
+            nested = stack.pop()
+            with self._lock:
+                self.phases[name] += elapsed - nested
+            if stack:
+                stack[-1] += elapsed
+
+    def phase_totals(self):
+        with self._lock:
+            return dict(self.phases)
+
+    def _percentile(self, durations, percentile):
+        durations = sorted(durations)
+        return durations[min(len(durations) - 1,
+                             int(len(durations) * percentile / 100))]
+
+    def summary(self):
+        """
+        Returns the summary printed by --stats as a string.
+        """
+        lines = ["{:<24} {:<8} {:>6} {:>6} {:>8} {:>8} {:>9} {:>10} "
+                 "{:>12}".format(
+                     "RPC", "Entity", "Calls", "Errors", "p50[ms]", "p99[ms]",
+                     "Entities", "Samples", "Bytes")]
+        with self._lock:
+            for (rpc, entity_type), call in sorted(self.calls.items()):
+                lines.append(
+                    "{:<24} {:<8} {:>6} {:>6} {:>8.2f} {:>8.2f} {:>9} {:>10} "
+                    "{:>12}".format(
+                        rpc, entity_type, len(call["durations"]),
+                        call["errors"],
+                        self._percentile(call["durations"], 50) * 1000,
+                        self._percentile(call["durations"], 99) * 1000,
+                        call["entities"], call["samples"], call["bytes"]))
+            total_bytes = sum(call["bytes"] for call in self.calls.values())
+            phases = dict(self.phases)
+        lines.append("Total bytes: {}".format(total_bytes))
+        lines.append("Time: " + ", ".join(
+            "{} {:.3f}s".format(phase, phases[phase])
+            for phase in self.PHASES))
+        return "\n".join(lines) + "\n"
+
+# ========================================================================
+
+
+class WorkerPool(object):
+    """
+    Pool of jobs threads sending time range queries concurrently, shared
+    by all the reporters of a Ui. Threads are started the first time a
+    report needs them, live reports never do.
+    """
+
+    def __init__(self, jobs=DEFAULT_JOBS):
+        self.jobs = max(1, jobs)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def imap(self, func, iterable):
+        with self._lock:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.jobs)
+            return self._pool.imap(func, iterable)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                # Batches still queued by an interrupted report are dropped
+                # instead of being sent to arithmos.
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+# ========================================================================
+
+
+def _conversion_phase(report_method):
+    """
+    Account the time of a report method of a Reporter as conversion, the
+    time waiting for arithmos inside it is accounted as fetch.
+    """
+    @functools.wraps(report_method)
+    def wrapper(self, *args, **kwargs):
+        with self.stats.phase("conversion"):
+            return report_method(self, *args, **kwargs)
+    return wrapper
+
+# ========================================================================
 
 
 class Reporter(object):
     """Reporter base """
 
-    def __init__(self):
-        self.interfaces = NutanixInterfaces()
-        self.arithmos_interface = ArithmosDataProcessing()
-        self.arithmos_client = self.interfaces.arithmos_client
+    ENTITY_LISTS = ["cluster", "node", "vm", "volume_group"]
+
+    def __init__(self, jobs=DEFAULT_JOBS, cache=None, datasource=None,
+                 stats=None, pool=None):
+        _import_arithmos()
+        self.datasource = datasource or ArithmosDataSource()
+        self.stats = stats or RpcStats()
         self.FIELD_NAMES = []
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        self.pool = pool or WorkerPool(self.jobs)
+        self._extraction_plans = {}
+        self._conversion_plans = {}
+        self.entity_name = self.__class__.__name__.replace(
+            "Reporter", "").lower()
 
     def _get_live_stats(self, entity_type, sort_criteria=None,
                         filter_criteria=None, search_term=None,
                         field_name_list=None):
-        ret = self.arithmos_interface.MasterGetEntitiesStats(
-            entity_type, sort_criteria, filter_criteria, search_term,
-            requested_field_name_list=field_name_list)
-        if ret:
-            response = ret.response
+        with self.stats.phase("fetch"):
+            start = timeit.default_timer()
+            response = self.datasource.get_entities_stats(
+                entity_type, sort_criteria, filter_criteria, search_term,
+                field_name_list)
+            duration = timeit.default_timer() - start
+
+        entities = 0
+        payload_bytes = 0
+        if response is not None:
+            entities = sum(len(getattr(response.entity_list, name, ()))
+                           for name in self.ENTITY_LISTS)
+            if hasattr(response, "ByteSize"):
+                payload_bytes = response.ByteSize()
+        field_name_list = field_name_list or []
+        self.stats.record("MasterGetEntitiesStats", self.entity_name,
+                          field_name_list, entities,
+                          entities * len(field_name_list), payload_bytes,
+                          duration)
+
+        if response is not None:
             if response.error == ArithmosErrorProto.kNoError:
                 return response
 
-    def _get_time_range_stat_values(self, entity_id, stat,
-                                    start, end, sampling_interval):
-        resp = self.arithmos_interface.MasterGetTimeRangeStats(entity_id,
-                                                               self._ARITHMOS_ENTITY_PROTO, stat,
-                                                               start, end,
-                                                               sampling_interval)
-        if resp:
-            for res in resp.response_list:
-                if res.error == ArithmosErrorProto.kNoError:
-                    return res.time_range_stat.value_list
-
-    def _get_time_range_stat_average(self, entity_id, stat,
-                                     start, end, sampling_interval=30):
-        values = self._get_time_range_stat_values(entity_id, stat,
-                                                  start, end,
-                                                  sampling_interval)
-        if values:
-            counter = 0
-            sum = 0
-            for value in values:
-                if value > 0:
-                    counter += 1
-                    sum += value
-            if sum > 0:
-                return sum / counter
-        return -1
+    def _get_time_range_stats_rpc(self, batch, start, end, sampling_interval):
+        """
+        Query the datasource for a batch of (entity_id, stat) tuples in a
+        single MasterGetTimeRangeStats RPC, see
+        ArithmosDataSource.get_time_range_stats().
+        """
+        rpc_start = timeit.default_timer()
+        batch_series = self.datasource.get_time_range_stats(
+            self._ARITHMOS_ENTITY_PROTO, batch, start, end, sampling_interval)
+        duration = timeit.default_timer() - rpc_start
+
+        failed = batch_series is None
+        if failed:
+            # Every request of a failed RPC is reported as failed.
+            batch_series = [None] * len(batch)
+        samples = sum(len(series[2]) for series in batch_series if series)
+        self.stats.record("MasterGetTimeRangeStats", self.entity_name,
+                          set(stat for _, stat in batch),
+                          len(set(entity_id for entity_id, _ in batch)),
+                          samples, samples * 8, duration, failed)
+        return batch_series
+
+    def _fetch_time_range_stats(self, request_list, start, end,
+                                sampling_interval=30):
+        """
+        Get a list of (entity_id, stat) tuples and query arithmos for the
+        samples of every stat between start and end.
+
+        Requests are packed in MasterGetTimeRangeStats RPCs of up to
+        TIME_RANGE_STATS_BATCH_SIZE requests, so the number of round trips
+        doesn't grow with the number of stats in a report. When jobs is
+        greater than one, requests are spread in at least as many RPCs as
+        jobs and sent concurrently from a pool of threads.
+
+        Yields, in the same order of request_list, a (start_usecs,
+        sampling_interval_secs, value_list) tuple per request or None when
+        arithmos returned an error for that request.
+        """
+        batch_size = min(TIME_RANGE_STATS_BATCH_SIZE,
+                         max(1, -(-len(request_list) // self.jobs)))
+        batches = [request_list[i:i + batch_size]
+                   for i in range(0, len(request_list), batch_size)]
+
+        if self.jobs > 1 and len(batches) > 1:
+            results = self.pool.imap(
+                lambda batch: self._get_time_range_stats_rpc(
+                    batch, start, end, sampling_interval),
+                batches)
+        else:
+            results = (self._get_time_range_stats_rpc(batch, start, end,
+                                                      sampling_interval)
+                       for batch in batches)
+
+        for batch_series in results:
+            for series in batch_series:
+                yield series
+
+    def _iter_time_range_stats(self, request_list, start, end,
+                               sampling_interval=30):
+        """
+        Same as _fetch_time_range_stats() but the part of the time range
+        already in the past is served from the cache when there is one.
+        Only series missing in the cache are requested to arithmos, for
+        the whole cache blocks overlapping the time range, and the part
+        too recent to be cached is always requested to arithmos.
+        """
+        span = self.cache.cacheable_span(start, end) if self.cache else None
+        if span is None:
+            for series in self._fetch_time_range_stats(request_list,
+                                                       start, end,
+                                                       sampling_interval):
+                yield series
+            return
+
+        span_start, span_end = span
+        cached = self.cache.get(self._ARITHMOS_ENTITY_PROTO, request_list,
+                                span_start, span_end, sampling_interval)
+        missing = [request for request in request_list
+                   if request not in cached]
+        fetched = {}
+        for request, series in zip(missing, self._fetch_time_range_stats(
+                missing, span_start, span_end, sampling_interval)):
+            if series:
+                series = (series[0], series[1], list(series[2]))
+                fetched[request] = series
+                cached[request] = series
+        self.cache.put(self._ARITHMOS_ENTITY_PROTO, fetched,
+                       span_start, span_end, sampling_interval)
+
+        recent = [None] * len(request_list)
+        if span_end < end:
+            recent = self._fetch_time_range_stats(request_list, span_end,
+                                                  end, sampling_interval)
+        for request, series in zip(request_list, recent):
+            yield self.cache.join_series([cached.get(request), series],
+                                         start, end)
+
+    def _get_time_range_stats_buckets(self, entity_id_list, field_list,
+                                      start, end, sec, sampling_interval=30,
+                                      agg="mean", convert=False):
+        """
+        Get a list of entity ids and a list of fields (stats) and returns the
+        aggregated value (average by default) of every field for every
+        interval of sec seconds between start and end.
+
+        Samples for the whole window are fetched once and split locally in
+        intervals by TimeRangeAggregator, instead of querying arithmos again
+        for every interval. The last interval may go beyond end, like in the
+        reports that walk the time range step by step. Returns a list with
+        an EntityTable per interval, with a row per entity in the same
+        order and a column per field. Columns are taken straight from the
+        aggregated series, no dictionary is built per entity.
+
+        With convert the unit conversion of _stats_unit_conversion() is
+        applied by the aggregator to every series at once, columns have the
+        converted names.
+        """
+        bucket_usecs = int(sec * 1000000)
+        num_buckets = max(1, -(-(end - start) // bucket_usecs))
+
+        request_list = [(entity_id, field)
+                        for entity_id in entity_id_list
+                        for field in field_list]
+        with self.stats.phase("fetch"):
+            series_list = list(self._iter_time_range_stats(
+                request_list, start, start + num_buckets * bucket_usecs,
+                sampling_interval))
+        divisors = None
+        if convert:
+            plan = self._get_conversion_plan(tuple(field_list))
+            field_list = [new_key for _, new_key, _ in plan]
+            divisors = [divisor or 1
+                        for _ in entity_id_list
+                        for _, _, divisor in plan]
+        aggregated = TimeRangeAggregator(agg).aggregate(
+            series_list, start, bucket_usecs, num_buckets, divisors)
+
+        if not entity_id_list:
+            return [EntityTable([], []) for _ in range(num_buckets)]
+        # Series are ordered by entity and then by field, the series of a
+        # field are every num_fields series. Transposing them gives the
+        # column of the field in every interval.
+        num_fields = len(field_list)
+        field_buckets = [list(zip(*aggregated[i::num_fields]))
+                         for i in range(num_fields)]
+        return [EntityTable(field_list, [EntityTable.pack(buckets[bucket])
+                                         for buckets in field_buckets])
+                for bucket in range(num_buckets)]
+
+    def _time_range_report_buckets(self, entity_list, field_list,
+                                   start, end, sec, sort, agg="mean"):
+        """
+        Returns a list of (interval start in usecs, sorted dictionary)
+        tuples for every interval of sec seconds between start and end.
+        Entities in entity_list are the ones returned by MasterGetEntitiesStats,
+        _set_time_range_attributes() needs to be defined by subclasses to
+        add the entity attributes to the stats. Attributes are the same in
+        every interval, their columns are built once.
+        """
+        buckets = self._get_time_range_stats_buckets(
+            [pivot.id for pivot in entity_list], field_list,
+            start, end, sec, agg=agg, convert=True)
+        attributes = []
+        for pivot in entity_list:
+            entity_attributes = {}
+            self._set_time_range_attributes(entity_attributes, pivot)
+            attributes.append(entity_attributes)
+        attribute_columns = EntityTable.from_dicts(attributes)
+        ret = []
+        for i, entities in enumerate(buckets):
+            if entity_list:
+                for key, column in zip(attribute_columns.keys,
+                                       attribute_columns.columns):
+                    entities.set_column(key, column)
+            ret.append((start + i * sec * 1000000,
+                        self._sort_entity_dict(entities, sort)))
+        return ret
+
+    def _get_conversion_plan(self, keys):
+        """
+        Returns a list of (key, new key, divisor) tuples for a tuple of
+        entity keys, divisor is None for keys that are not converted. Plans
+        are computed once per tuple of keys.
+        """
+        plan = self._conversion_plans.get(keys)
+        if plan is None:
+            plan = []
+            for key in keys:
+                for unit, new_unit, divisor in UNIT_CONVERSIONS:
+                    if unit in key:
+                        plan.append((key, key.replace(unit, new_unit),
+                                     divisor))
+                        break
+                else:
+                    plan.append((key, key, None))
+            self._conversion_plans[keys] = plan
+        return plan
 
     def _stats_unit_conversion(self, entities_dict):
         """
@@ -425,90 +2232,117 @@ class Reporter(object):
         the value is changed from parts per million to percentage.
 
         It uses the stat names to identify the current unit value and change it
-        to an arbitrary desired unit.
+        to an arbitrary desired unit, see UNIT_CONVERSIONS. Names are only
+        checked once per set of keys, see _get_conversion_plan().
+
+        Arithmos returns -1 when there is no data, negative numbers are
+        set back to -1 after the conversion.
+
+        Entities are converted column by column into an EntityTable, with
+        the keys of the first entity.
         """
-        ret = []
-        for entity in entities_dict:
-            converted_entity = {}
-            for key in entity.keys():
-                new_key = ""
-                if "ppm" in key:
-                    new_key = key.replace("ppm", "percent")
-                    new_value = entity[key] / 10000
-                    converted_entity[new_key] = new_value
-                elif "kBps" in key:
-                    new_key = key.replace("kBps", "mBps")
-                    new_value = entity[key] / 1024
-                    converted_entity[new_key] = new_value
-                elif "bytes" in key:
-                    new_key = key.replace("bytes", "Mbytes")
-                    new_value = entity[key] / 1048576
-                    converted_entity[new_key] = new_value
-                elif "usecs" in key:
-                    new_key = key.replace("usecs", "msecs")
-                    new_value = entity[key] / 1000
-                    converted_entity[new_key] = new_value
-                else:
-                    new_key = key
-                    converted_entity[new_key] = entity[new_key]
+        if not entities_dict:
+            return EntityTable([], [])
+        plan = self._get_conversion_plan(tuple(entities_dict[0]))
+        keys = []
+        columns = []
+        for key, new_key, divisor in plan:
+            values = [entity.get(key, -1) for entity in entities_dict]
+            if divisor:
+                values = [value / divisor if value >= 0 else -1
+                          for value in values]
+            else:
+                values = [-1 if value.__class__ in NUMBER_TYPES and
+                          value < 0 else value
+                          for value in values]
+            keys.append(new_key)
+            columns.append(EntityTable.pack(values))
 
-                # Set back to -1 if we divided in the previos statements.
-                # This is because arithmos returns -1 when there is no data.
-                if converted_entity[new_key] < 0:
-                    converted_entity[new_key] = -1
-            ret.append(converted_entity)
+        return EntityTable(keys, columns)
 
-        return ret
+    def _get_extraction_plan(self, entity, field_list):
+        """
+        Returns the plan to extract field_list from entities like entity,
+        computed once per stats message type and field list:
+
+          (field set, [(field, getter)], has generic stats,
+           has generic attributes)
+
+        Getters read a field of stats or stats.common_stats straight from
+        the entity, fields of common_stats take precedence like in
+        _get_entity_stats_from_proto().
+        """
+        stats = getattr(entity, "stats", None)
+        descriptor = stats.DESCRIPTOR if stats is not None else None
+        key = (descriptor, tuple(field_list))
+        plan = self._extraction_plans.get(key)
+        if plan is not None:
+            return plan
+
+        getters = {}
+        has_generic_stats = False
+        if stats is not None:
+            stats_fields = set(field.name for field in descriptor.fields)
+            has_generic_stats = "generic_stat_list" in stats_fields
+            stats_fields -= set(["common_stats", "generic_stat_list"])
+            for field in field_list:
+                if field in stats_fields:
+                    getters[field] = operator.attrgetter("stats." + field)
+            if hasattr(stats, "common_stats"):
+                common_fields = set(
+                    field.name
+                    for field in stats.common_stats.DESCRIPTOR.fields)
+                for field in field_list:
+                    if field in common_fields:
+                        getters[field] = operator.attrgetter(
+                            "stats.common_stats." + field)
+
+        plan = (frozenset(field_list),
+                [(field, getters[field]) for field in field_list
+                 if field in getters],
+                has_generic_stats,
+                hasattr(entity, "generic_attribute_list"))
+        self._extraction_plans[key] = plan
+        return plan
 
     def _get_entity_stats_from_proto(self, entity, field_list):
         """
         Get an entity protobufer and return a dictionary with
         desired fields.
         Missing fields are populated with -1.
-        """
-        entity_dict = {}
-
-        if hasattr(entity, "stats"):
-            stats = entity.stats
 
-            for tmp_stat in stats.DESCRIPTOR.fields:
-                if (tmp_stat.name != "common_stats" and
-                   tmp_stat.name != "generic_stat_list"):
-                    if tmp_stat.name in field_list:
-                        entity_dict[tmp_stat.name] = getattr(
-                            stats, tmp_stat.name)
-
-            if hasattr(stats, "common_stats"):
-                for tmp_common_stat in stats.common_stats.DESCRIPTOR.fields:
-                    if tmp_common_stat.name in field_list:
-                        entity_dict[tmp_common_stat.name] = getattr(
-                            stats.common_stats, tmp_common_stat.name)
-
-            if hasattr(stats, "generic_stat_list"):
-                for tmp_generic_stat in stats.generic_stat_list:
-                    entity_dict[tmp_generic_stat.stat_name] = tmp_generic_stat.stat_value
-
-        if hasattr(entity, "generic_attribute_list"):
-            for tmp_generic_attr in entity.generic_attribute_list:
-                name = None
-                value = None
-                for field, _ in tmp_generic_attr.ListFields():
-                    if field.name == "attribute_name":
-                        name = str(getattr(tmp_generic_attr, field.name))
-                    elif field.name == "attribute_value_str":
-                        value = getattr(tmp_generic_attr, str(field.name))
-                    elif field.name == "attribute_value_int":
-                        value = getattr(tmp_generic_attr, field.name)
-                    elif hasattr(generic_attr, "attribute_value_str_list"):
-                        value = getattr(tmp_generic_attr, field.name)
-                if name is not None and value is not None:
-                    entity_dict[name] = value
+        Fields are read with the plan from _get_extraction_plan(), so the
+        cost per entity depends on the number of desired fields and not on
+        the number of fields of the protobuf.
+        """
+        field_set, getters, has_generic_stats, has_generic_attributes = \
+            self._get_extraction_plan(entity, field_list)
 
         # Method returns a dictionary with all fields in field_list,
         # if there is a missing field, populate with -1.
-        for field in field_list:
-            if not field in entity_dict.keys():
-                entity_dict[field] = -1
+        entity_dict = dict.fromkeys(field_list, -1)
+        for field, getter in getters:
+            entity_dict[field] = getter(entity)
+
+        if has_generic_stats:
+            for generic_stat in entity.stats.generic_stat_list:
+                if generic_stat.stat_name in field_set:
+                    entity_dict[generic_stat.stat_name] = \
+                        generic_stat.stat_value
+
+        if has_generic_attributes:
+            for generic_attr in entity.generic_attribute_list:
+                name = str(generic_attr.attribute_name)
+                if name not in field_set:
+                    continue
+                value = None
+                for field, field_value in generic_attr.ListFields():
+                    if field.name in ("attribute_value_str",
+                                      "attribute_value_int",
+                                      "attribute_value_str_list"):
+                        value = field_value
+                if value is not None:
+                    entity_dict[name] = value
 
         return entity_dict
 
@@ -589,12 +2423,13 @@ class Reporter(object):
                 attributes[desired_attribute] = "-"
         return attributes
 
-    def _sort_entity_dict(self, nodes_stats_dic, sort, default_sort_field="name"):
+    def _sort_entity_dict(self, nodes_stats_dic, sort, default_sort_field="name",
+                          top=None):
         """
         Get a list of entities dictionaries and a sort key. The sort key is
         translated into a field using 'self.sort_conversion' and is
         equivalent to an arithmos field. Then the list is sorted based on
-        this criteria.
+        this criteria. With top only the first top entities are returned.
 
         The conversion dictionary 'self.sort_conversion' needs to be defined in the
         subclasses according to their sorting criteria.
@@ -607,26 +2442,81 @@ class Reporter(object):
         # This is because the default sort field "name" is the only alphabetic,
         # other fields are are numeric and needs to be sorted in reverse.
         # TODO: May need to think better about this later.
-        if sort_by == self.sort_conversion[default_sort_field]:
-            return sorted(nodes_stats_dic,
+        reverse = sort_by != self.sort_conversion[default_sort_field]
+        if isinstance(nodes_stats_dic, EntityTable):
+            return nodes_stats_dic.sorted(sort_by, reverse, top)
+        if top is not None:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return select(top, nodes_stats_dic,
                           key=lambda node: node[sort_by])
+        return sorted(nodes_stats_dic,
+                      key=lambda node: node[sort_by], reverse=reverse)
+
+    def _select_top_entities(self, entity_list, sort_by_arithmos, field_list,
+                             top=None):
+        """
+        Get an entity_list as returned from MasterGetEntitiesStats and
+        returns only the first top entities by the arithmos sort field,
+        picked with a heap on the raw field. Entities left out are never
+        extracted nor converted, so the cost of a top N report barely
+        depends on the number of entities.
+
+        Negative values are -1 for the heap like after the unit conversion,
+        so the entities picked are the ones _sort_entity_dict() would pick.
+        Subclasses need to define 'self.sort_conversion_arithmos'.
+        """
+        field = sort_by_arithmos.lstrip("-")
+        if top is None or top >= len(entity_list) or field not in field_list:
+            return entity_list
+        fields = [field]
+        getters = self._get_extraction_plan(entity_list[0], fields)[1]
+        if field == self.sort_conversion_arithmos["name"]:
+            def sort_key(entity):
+                return str(getattr(entity, field))
+        elif getters:
+            getter = getters[0][1]
+
+            def sort_key(entity):
+                value = getter(entity)
+                return value if value >= 0 else -1
         else:
-            return sorted(nodes_stats_dic,
-                          key=lambda node: node[sort_by], reverse=True)
+            # Generic stats and attributes need the whole extraction.
+            def sort_key(entity):
+                value = self._get_entity_stats_from_proto(entity,
+                                                          fields)[field]
+                return value if value >= 0 else -1
+        select = (heapq.nlargest if sort_by_arithmos.startswith("-")
+                  else heapq.nsmallest)
+        return select(top, entity_list, key=sort_key)
 
 
 class ClusterReporter(Reporter):
     """Reports for Clusters"""
 
-    def __init__(self):
-        Reporter.__init__(self)
+    def __init__(self, jobs=DEFAULT_JOBS, cache=None, datasource=None,
+                 stats=None, pool=None):
+        Reporter.__init__(self, jobs, cache, datasource, stats, pool)
         self._ARITHMOS_ENTITY_PROTO = ArithmosEntityProto.kCluster
         self.max_cluster_name_width = 0
+        self._cluster = None
 
-        self.cluster = self._get_cluster_live_stats(
-            field_name_list=["cluster_name", "id"])
-        self.name = self.cluster[0].cluster_name
-        self.cluster_id = self.cluster[0].id
+    @property
+    def cluster(self):
+        """
+        Cluster entity, queried the first time it's needed.
+        """
+        if self._cluster is None:
+            self._cluster = self._get_cluster_live_stats(
+                field_name_list=["cluster_name", "id"])
+        return self._cluster
+
+    @property
+    def name(self):
+        return self.cluster[0].cluster_name
+
+    @property
+    def cluster_id(self):
+        return self.cluster[0].id
 
     def _get_cluster_live_stats(self, sort_criteria=None, filter_criteria=None,
                                 search_term=None, field_name_list=None):
@@ -648,8 +2538,9 @@ class ClusterReporter(Reporter):
 class NodeReporter(Reporter):
     """Reports for Nodes"""
 
-    def __init__(self):
-        Reporter.__init__(self)
+    def __init__(self, jobs=DEFAULT_JOBS, cache=None, datasource=None,
+                 stats=None, pool=None):
+        Reporter.__init__(self, jobs, cache, datasource, stats, pool)
         self._ARITHMOS_ENTITY_PROTO = ArithmosEntityProto.kNode
         self.max_node_name_width = 0
 
@@ -662,8 +2553,18 @@ class NodeReporter(Reporter):
             "lat": "avg_io_latency_msecs"
         }
 
-        self.nodes = self._get_node_live_stats(sort_criteria="node_name",
-                                               field_name_list=["node_name", "id"])
+        self._nodes = None
+
+    @property
+    def nodes(self):
+        """
+        Nodes names and ids for time range reports, queried the first time
+        they are needed.
+        """
+        if self._nodes is None:
+            self._nodes = self._get_node_live_stats(
+                sort_criteria="node_name", field_name_list=["node_name", "id"])
+        return self._nodes
 
     def _get_node_live_stats(self, sort_criteria=None, filter_criteria=None,
                              search_term=None, field_name_list=None):
@@ -687,25 +2588,11 @@ class NodeReporter(Reporter):
             node_stats_dic.append(node_dict)
         return node_stats_dic
 
-    def _get_time_range_stats_dic(self, field_list, start, end, sampling_interval=30):
-        """
-        Get a list of fields (stats), a time frame specified by start and end,
-        the desired interval and collects from arithmos the average values.
-        """
-        nodes_stats_dic = []
-        for node_pivot in self.nodes:
-            node = {}
-            for field in field_list:
-                value = self._get_time_range_stat_average(
-                    node_pivot.id, field, start, end,
-                    sampling_interval
-                )
-                node[field] = value
-            node["node_name"] = str(node_pivot.node_name)
-            node["node_id"] = int(node_pivot.id)
-            nodes_stats_dic.append(node)
-        return nodes_stats_dic
+    def _set_time_range_attributes(self, node, node_pivot):
+        node["node_name"] = str(node_pivot.node_name)
+        node["node_id"] = int(node_pivot.id)
 
+    @_conversion_phase
     def overall_live_report(self, sort="name"):
         """
         Returns a sorted dictionary with nodes overall stats.
@@ -718,15 +2605,18 @@ class NodeReporter(Reporter):
         ret = self._stats_unit_conversion(ret)
         return self._sort_entity_dict(ret, sort)
 
-    def overall_time_range_report(self, start, end, sort="name", nodes=[]):
+    @_conversion_phase
+    def overall_time_range_buckets(self, start, end, sec, sort="name",
+                                   nodes=[], agg="mean"):
         """
-        Returns a sorted dictionary with time range nodes overall stats.
+        Returns a list of (interval start, sorted dictionary) tuples with
+        time range nodes overall stats for every interval of sec seconds.
         """
-        ret = self._get_time_range_stats_dic(
-            NODES_OVERALL_REPORT_ARITHMOS_FIELDS, start, end)
-        ret = self._stats_unit_conversion(ret)
-        return self._sort_entity_dict(ret, sort)
+        return self._time_range_report_buckets(
+            self.nodes, NODES_OVERALL_REPORT_ARITHMOS_FIELDS,
+            start, end, sec, sort, agg)
 
+    @_conversion_phase
     def iops_live_report(self, sort="name"):
         """
         Returns a sorted dictionary with live nodes IOPS stats.
@@ -739,15 +2629,18 @@ class NodeReporter(Reporter):
         ret = self._stats_unit_conversion(ret)
         return self._sort_entity_dict(ret, sort)
 
-    def iops_time_range_report(self, start, end, sort="name", nodes=[]):
+    @_conversion_phase
+    def iops_time_range_buckets(self, start, end, sec, sort="name",
+                                nodes=[], agg="mean"):
         """
-        Returns a sorted dictionary with time range node IOPS stats.
+        Returns a list of (interval start, sorted dictionary) tuples with
+        time range nodes IOPS stats for every interval of sec seconds.
         """
-        ret = self._get_time_range_stats_dic(
-            NODES_IOPS_REPORT_ARITHMOS_FIELDS, start, end)
-        ret = self._stats_unit_conversion(ret)
-        return self._sort_entity_dict(ret, sort)
+        return self._time_range_report_buckets(
+            self.nodes, NODES_IOPS_REPORT_ARITHMOS_FIELDS,
+            start, end, sec, sort, agg)
 
+    @_conversion_phase
     def bw_live_report(self, sort="name"):
         """
         Returns a sorted dictionary with live nodes bandwidth stats.
@@ -760,15 +2653,18 @@ class NodeReporter(Reporter):
         ret = self._stats_unit_conversion(ret)
         return self._sort_entity_dict(ret, sort)
 
-    def bw_time_range_report(self, start, end, sort="name", nodes=[]):
+    @_conversion_phase
+    def bw_time_range_buckets(self, start, end, sec, sort="name",
+                              nodes=[], agg="mean"):
         """
-        Returns a sorted dictionary with time range nodes bandwidth stats.
+        Returns a list of (interval start, sorted dictionary) tuples with
+        time range nodes bandwidth stats for every interval of sec seconds.
         """
-        ret = self._get_time_range_stats_dic(
-            NODES_BANDWIDTH_REPORT_ARITHMOS_FIELDS, start, end)
-        ret = self._stats_unit_conversion(ret)
-        return self._sort_entity_dict(ret, sort)
+        return self._time_range_report_buckets(
+            self.nodes, NODES_BANDWIDTH_REPORT_ARITHMOS_FIELDS,
+            start, end, sec, sort, agg)
 
+    @_conversion_phase
     def lat_live_report(self, sort="name"):
         """
         Returns a sorted dictionary with live nodes bandwidth stats.
@@ -781,21 +2677,24 @@ class NodeReporter(Reporter):
         ret = self._stats_unit_conversion(ret)
         return self._sort_entity_dict(ret, sort)
 
-    def lat_time_range_report(self, start, end, sort="name", nodes=[]):
+    @_conversion_phase
+    def lat_time_range_buckets(self, start, end, sec, sort="name",
+                               nodes=[], agg="mean"):
         """
-        Returns a sorted dictionary with time range nodes bandwidth stats.
+        Returns a list of (interval start, sorted dictionary) tuples with
+        time range nodes latency stats for every interval of sec seconds.
         """
-        ret = self._get_time_range_stats_dic(
-            NODES_LATENCY_REPORT_ARITHMOS_FIELDS, start, end)
-        ret = self._stats_unit_conversion(ret)
-        return self._sort_entity_dict(ret, sort)
+        return self._time_range_report_buckets(
+            self.nodes, NODES_LATENCY_REPORT_ARITHMOS_FIELDS,
+            start, end, sec, sort, agg)
 
 
 class VmReporter(Reporter):
     """Reports for UVMs"""
 
-    def __init__(self):
-        Reporter.__init__(self)
+    def __init__(self, jobs=DEFAULT_JOBS, cache=None, datasource=None,
+                 stats=None, pool=None):
+        Reporter.__init__(self, jobs, cache, datasource, stats, pool)
         self._ARITHMOS_ENTITY_PROTO = ArithmosEntityProto.kVM
         self.max_vm_name_width = 0
 
@@ -816,7 +2715,7 @@ class VmReporter(Reporter):
         self.sort_conversion_arithmos = {
             "name": "vm_name",
             "cpu": "-hypervisor_cpu_usage_ppm",
-            "rdy": "hypervisor.cpu_ready_time_ppm",
+            "rdy": "-hypervisor.cpu_ready_time_ppm",
             "mem": "-memory_usage_ppm",
             "iops": "-controller_num_iops",
             "bw": "-controller_io_bandwidth_kBps",
@@ -839,31 +2738,15 @@ class VmReporter(Reporter):
         vm_stats_dic = []
         for vm_entity in entity_list:
             vm_dict = self._get_entity_stats_from_proto(vm_entity, field_list)
-            vm_dict["id"] = vm_entity.id
-            vm_dict["vm_name"] = str(vm_entity.vm_name)
-            vm_stats_dic.append(vm_dict)
-        return vm_stats_dic
-
-    def _get_time_range_stats_dic(self, entity_list, field_list,
-                                  start, end, sampling_interval=30):
-        """
-        Get an entity_list as returned from MasterGetEntitiesStats,
-        parse the entities and stats to a dictinary and returns.
-        """
-        vm_stats_dic = []
-        for vm_pivot in entity_list:
-            vm = {}
-            for field in field_list:
-                value = self._get_time_range_stat_average(
-                    vm_pivot.id, field, start, end,
-                    sampling_interval
-                )
-                vm[field] = value
-            vm["vm_name"] = str(vm_pivot.vm_name)
-            vm["id"] = vm_pivot.id
-            vm_stats_dic.append(vm)
+            vm_dict["id"] = vm_entity.id
+            vm_dict["vm_name"] = str(vm_entity.vm_name)
+            vm_stats_dic.append(vm_dict)
         return vm_stats_dic
 
+    def _set_time_range_attributes(self, vm, vm_pivot):
+        vm["vm_name"] = str(vm_pivot.vm_name)
+        vm["id"] = vm_pivot.id
+
     def _get_arithmos_sort_field(self, sort, default_sort_field="name"):
         """
         Returns the arithmos field for sort criteria. The sort key is
@@ -880,6 +2763,7 @@ class VmReporter(Reporter):
             sort_by_arithmos = self.sort_conversion_arithmos[sort]
         else:
             sort_by_arithmos = self.sort_conversion_arithmos[default_sort_field]
+        return sort_by_arithmos
 
     def _get_arithmos_filter_criteria_live(self, node_names=[], power_on=True):
         """
@@ -899,9 +2783,11 @@ class VmReporter(Reporter):
                 filter_by += node_names_str
         return filter_by
 
-    def overall_live_report(self, sort="name", node_names=[]):
+    @_conversion_phase
+    def overall_live_report(self, sort="name", node_names=[], top=None):
         """
-        Returns a sorted dictionary with VMs overall stats.
+        Returns a sorted dictionary with VMs overall stats, only the first top
+        VMs when top is given.
         """
         sort_by_arithmos = self._get_arithmos_sort_field(sort)
         filter_by = self._get_arithmos_filter_criteria_live(node_names)
@@ -910,16 +2796,20 @@ class VmReporter(Reporter):
             field_list=VM_OVERALL_REPORT_ARITHMOS_FIELDS,
             filter_criteria=filter_by,
             sort_criteria=sort_by_arithmos)
+        entity_list = self._select_top_entities(
+            entity_list, sort_by_arithmos, VM_OVERALL_REPORT_ARITHMOS_FIELDS, top)
 
         ret = self._get_live_stats_dic(entity_list,
                                        VM_OVERALL_REPORT_ARITHMOS_FIELDS)
         ret = self._stats_unit_conversion(ret)
 
-        return self._sort_entity_dict(ret, sort)
+        return self._sort_entity_dict(ret, sort, top=top)
 
-    def iops_live_report(self, sort="name", node_names=[]):
+    @_conversion_phase
+    def iops_live_report(self, sort="name", node_names=[], top=None):
         """
-        Returns a sorted dictionary with VMs IOPs stats.
+        Returns a sorted dictionary with VMs IOPs stats, only the first top
+        VMs when top is given.
         """
         sort_by_arithmos = self._get_arithmos_sort_field(sort)
         filter_by = self._get_arithmos_filter_criteria_live(node_names)
@@ -928,14 +2818,22 @@ class VmReporter(Reporter):
             field_list=VM_IOPS_REPORT_ARITHMOS_FIELDS,
             filter_criteria=filter_by,
             sort_criteria=sort_by_arithmos)
+        entity_list = self._select_top_entities(
+            entity_list, sort_by_arithmos, VM_IOPS_REPORT_ARITHMOS_FIELDS, top)
 
         ret = self._get_live_stats_dic(entity_list,
                                        VM_IOPS_REPORT_ARITHMOS_FIELDS)
         ret = self._stats_unit_conversion(ret)
 
-        return self._sort_entity_dict(ret, sort)
+        return self._sort_entity_dict(ret, sort, top=top)
 
-    def overall_time_range_report(self, start, end, sort="name", node_names=[]):
+    @_conversion_phase
+    def overall_time_range_buckets(self, start, end, sec, sort="name",
+                                   node_names=[], agg="mean"):
+        """
+        Returns a list of (interval start, sorted dictionary) tuples with
+        time range VMs overall stats for every interval of sec seconds.
+        """
         sort_by_arithmos = self._get_arithmos_sort_field(sort)
         filter_by = self._get_arithmos_filter_criteria_live(
             node_names, power_on=False)
@@ -945,19 +2843,17 @@ class VmReporter(Reporter):
                                           filter_criteria=filter_by,
                                           sort_criteria=sort_by_arithmos)
 
-        generic_attribute_names = ["node_name"]
-        ret = self._get_time_range_stats_dic(vm_list, VM_OVERALL_REPORT_ARITHMOS_FIELDS,
-                                             start, end)
-        ret = self._stats_unit_conversion(ret)
-
-        return self._sort_entity_dict(ret, sort)
+        return self._time_range_report_buckets(
+            vm_list, VM_OVERALL_REPORT_ARITHMOS_FIELDS, start, end, sec, sort,
+            agg)
 
 
 class VgReporter(Reporter):
     """Reporter for Volume Groups"""
 
-    def __init__(self):
-        Reporter.__init__(self)
+    def __init__(self, jobs=DEFAULT_JOBS, cache=None, datasource=None,
+                 stats=None, pool=None):
+        Reporter.__init__(self, jobs, cache, datasource, stats, pool)
         self._ARITHMOS_ENTITY_PROTO = ArithmosEntityProto.kVolumeGroup
 
         # The reason this conversion exists is because we want to abstract
@@ -997,28 +2893,13 @@ class VgReporter(Reporter):
         for vg_entity in entity_list:
             vg_dict = self._get_entity_stats_from_proto(vg_entity, field_list)
             vg_dict["id"] = vg_entity.id
+            vg_dict["volume_group_name"] = str(vg_entity.volume_group_name)
             vg_stats_dic.append(vg_dict)
         return vg_stats_dic
 
-    def _get_time_range_stats_dic(self, entity_list, field_list,
-                                  start, end, sampling_interval=30):
-        """
-        Get an entity_list as returned from MasterGetEntitiesStats,
-        parse the entities and stats to a dictinary and returns.
-        """
-        vg_stats_dic = []
-        for vg_pivot in entity_list:
-            vg = {}
-            for field in field_list:
-                value = self._get_time_range_stat_average(
-                    vg_pivot.id, field, start, end,
-                    sampling_interval
-                )
-                vg[field] = value
-            vg["volume_group_name"] = str(vg_pivot.volume_group_name)
-            vg["id"] = vg_pivot.id
-            vg_stats_dic.append(vg)
-        return vg_stats_dic
+    def _set_time_range_attributes(self, vg, vg_pivot):
+        vg["volume_group_name"] = str(vg_pivot.volume_group_name)
+        vg["id"] = vg_pivot.id
 
     def _get_arithmos_sort_field(self, sort, default_sort_field="name"):
         """
@@ -1038,31 +2919,137 @@ class VgReporter(Reporter):
             sort_by_arithmos = self.sort_conversion_arithmos[default_sort_field]
         return sort_by_arithmos
 
-    def overall_live_report(self, sort="name"):
+    @_conversion_phase
+    def overall_live_report(self, sort="name", top=None):
         """
-        Returns a sorted dictionary with volume groups overall stats.
+        Returns a sorted dictionary with volume groups overall stats, only
+        the first top volume groups when top is given.
         """
         sort_by_arithmos = self._get_arithmos_sort_field(sort)
 
         entity_list = self._get_vg_live_stats(
             field_list=VG_OVERALL_REPORT_ARITHMOS_FIELDS,
             sort_criteria=sort_by_arithmos)
+        entity_list = self._select_top_entities(
+            entity_list, sort_by_arithmos, VG_OVERALL_REPORT_ARITHMOS_FIELDS,
+            top)
         ret = self._get_live_stats_dic(entity_list,
                                        VG_OVERALL_REPORT_ARITHMOS_FIELDS)
         ret = self._stats_unit_conversion(ret)
 
-        return self._sort_entity_dict(ret, sort)
+        return self._sort_entity_dict(ret, sort, top=top)
+
+
+class RowFormatter(object):
+    """
+    Formatter of entity rows for a list of *_CLI_FIELDS. The header and
+    row format strings are built once, see Ui._get_row_formatter().
+    """
+
+    def __init__(self, field_list):
+        self.keys = [field["key"] for field in field_list]
+        header_format_string = ""
+        entity_format_string = ""
+        for i, field in enumerate(field_list):
+            header_format_string += "{{{0}:{1}{2}}} ".format(
+                i, field["align"], field["width"])
+            entity_format_string += "{{{0}:{1}{2}{3}}} ".format(
+                i, field["align"], field["width"], field["format"])
+        self.header = header_format_string.format(
+            *[field["header"] for field in field_list])
+        self.format_row = entity_format_string.format
+
+    def rows(self, entity_list, start=0, stop=None):
+        """
+        Returns the formatted rows of entity_list, a list of dictionaries
+        or an EntityTable. Only rows from start to stop are formatted.
+        """
+        if isinstance(entity_list, EntityTable):
+            return list(map(self.format_row,
+                            *[entity_list.column(key)[start:stop]
+                              for key in self.keys]))
+        return [self.format_row(*[entity[key] for key in self.keys])
+                for entity in entity_list[start:stop]]
 
 
 class Ui(object):
     """Display base"""
 
-    def __init__(self):
-        self.cluster_reporter = ClusterReporter()
-        self.node_reporter = NodeReporter()
-        self.vm_reporter = VmReporter()
-        self.vg_reporter = VgReporter()
-        self.UiUuid = uuid.uuid1()
+    def __init__(self, jobs=DEFAULT_JOBS, cache_dir=DEFAULT_CACHE_DIR,
+                 cache_size=DEFAULT_CACHE_SIZE_MB, connect=True,
+                 datasource=None, stats=None):
+        self.stats = stats or RpcStats()
+        self._row_formatters = {}
+        self._reporters = {}
+        self.pool = None
+        self.datasource = None
+        self._owns_datasource = False
+        if not connect:
+            # Rendering saved snapshots doesn't need arithmos.
+            return
+        # All reporters share the same datasource, arithmos by default or a
+        # recording with --replay, and the same pool of threads. Reporters
+        # are created the first time a report needs them, a VGs report
+        # doesn't query nodes.
+        self.jobs = jobs
+        self.pool = WorkerPool(jobs)
+        self.datasource = datasource
+        if datasource is None:
+            self.datasource = ArithmosDataSource()
+            self._owns_datasource = True
+        self.cache = None
+        if cache_dir:
+            self.cache = TimeRangeStatsCache(
+                lambda: self.cluster_reporter.cluster_id, cache_dir,
+                cache_size)
+
+    def _get_reporter(self, reporter_class):
+        reporter = self._reporters.get(reporter_class)
+        if reporter is None:
+            reporter = reporter_class(self.jobs, self.cache, self.datasource,
+                                      self.stats, self.pool)
+            self._reporters[reporter_class] = reporter
+        return reporter
+
+    def close(self):
+        """
+        Stop the pool of threads and close the datasource when it was
+        created by the Ui, a datasource given to the Ui is closed by its
+        owner.
+        """
+        if self.pool is not None:
+            self.pool.close()
+        if self._owns_datasource:
+            self.datasource.close()
+
+    @property
+    def cluster_reporter(self):
+        return self._get_reporter(ClusterReporter)
+
+    @property
+    def node_reporter(self):
+        return self._get_reporter(NodeReporter)
+
+    @property
+    def vm_reporter(self):
+        return self._get_reporter(VmReporter)
+
+    @property
+    def vg_reporter(self):
+        return self._get_reporter(VgReporter)
+
+    def _get_row_formatter(self, field_list):
+        """
+        Returns the RowFormatter of field_list, built on first use.
+        """
+        cache_key = tuple((field["key"], field["header"], field["align"],
+                           field["width"], field["format"])
+                          for field in field_list)
+        formatter = self._row_formatters.get(cache_key)
+        if formatter is None:
+            formatter = RowFormatter(field_list)
+            self._row_formatters[cache_key] = formatter
+        return formatter
 
     def time_validator(self, start_time, end_time,
                        sec=None):
@@ -1102,48 +3089,74 @@ class Ui(object):
             return sec
         return sec
 
+    def _time_range_windows(self, start_time, end_time, sec):
+        """
+        Split the time range between start_time and end_time in windows of
+        up to TIME_RANGE_WINDOW_MAX_INTERVALS intervals of sec seconds.
+        Yields (start, end) tuples in usecs, every window but the last one
+        ends in an interval boundary.
+        """
+        usec_start = int(start_time.strftime("%s") + "000000")
+        usec_end = int(end_time.strftime("%s") + "000000")
+        window_usecs = sec * 1000000 * TIME_RANGE_WINDOW_MAX_INTERVALS
+        while usec_start < usec_end:
+            yield usec_start, min(usec_start + window_usecs, usec_end)
+            usec_start += window_usecs
+
+    def _usecs_to_str(self, usecs):
+        return datetime.datetime.fromtimestamp(
+            usecs // 1000000).strftime("%Y/%m/%d-%H:%M:%S")
+
 
 class UiCli(Ui):
     """CLI interface"""
 
+    def __init__(self, jobs=DEFAULT_JOBS, cache_dir=DEFAULT_CACHE_DIR,
+                 cache_size=DEFAULT_CACHE_SIZE_MB, save=None, connect=True,
+                 datasource=None, stats=None):
+        Ui.__init__(self, jobs, cache_dir, cache_size, connect, datasource,
+                    stats)
+        self.save = save
+        self.snapshot = None
+        self.snapshot_reporter = None
+
+    def _start_snapshot(self, reporter):
+        """
+        Frames printed by the report are saved in a snapshot when --save
+        is used, the reporter provides the sort conversion to re-sort them.
+        """
+        self.snapshot_reporter = reporter
+
+    def close_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
     def _report_format_printer(self, field_list, entity_list, str_time):
         """
         """
-        header_format_string = ""
-        entity_format_string = ""
-        for i in range(len(field_list)):
-            header_format_string += ("{" +
-                                     str(i) + ":" +
-                                     field_list[i]["align"] +
-                                     str(field_list[i]["width"]) +
-                                     "} "
-                                     )
-            entity_format_string += ("{" +
-                                     str(i) + ":" +
-                                     field_list[i]["align"] +
-                                     str(field_list[i]["width"]) +
-                                     field_list[i]["format"] +
-                                     "} "
-                                     )
-        header_list = []
-        for i in range(len(field_list)):
-            header_list.append(field_list[i]["header"])
+        with self.stats.phase("format"):
+            return self._report_format_print(field_list, entity_list,
+                                             str_time)
+
+    def _report_format_print(self, field_list, entity_list, str_time):
+        if self.save and self.snapshot_reporter is not None:
+            if self.snapshot is None:
+                self.snapshot = ReportSnapshot(self.save)
+                self.snapshot.open(field_list,
+                                   self.snapshot_reporter.sort_conversion)
+            self.snapshot.add_frame(str_time, entity_list)
 
         BOLD = '\033[1m'
         END = '\033[0m'
-        print((BOLD + str_time + " | " +
-               header_format_string + END).format(*header_list))
-
-        for entity in entity_list:
-            entity_stat_list = []
-            for i in range(len(field_list)):
-                stat_key = field_list[i]["key"]
-                stat_value = entity[stat_key]
-                entity_stat_list.append(stat_value)
-            print(str_time + " | " +
-                  entity_format_string.format(*entity_stat_list))
-
-        print("")
+        formatter = self._get_row_formatter(field_list)
+        prefix = str_time + " | "
+        lines = [BOLD + prefix + formatter.header + END]
+        lines.extend([prefix + row for row in formatter.rows(entity_list)])
+        # One write per interval, the last newline leaves an empty line
+        # between intervals.
+        lines.append("\n")
+        sys.stdout.write("\n".join(lines))
         return True
 
     def nodes_live_report(self, sec, count, sort="name",
@@ -1151,6 +3164,7 @@ class UiCli(Ui):
         """
         Print nodes live reports.
         """
+        self._start_snapshot(self.node_reporter)
         if not sec or sec < 0:
             sec = 0
             count = 1
@@ -1187,67 +3201,50 @@ class UiCli(Ui):
 
     def nodes_time_range_report(self, start_time, end_time, sec=None,
                                 sort="name", node_names=[],
-                                report_type="overall"):
+                                report_type="overall", agg="mean"):
         """
         Print nodes overall time range report.
         """
+        self._start_snapshot(self.node_reporter)
         sec = self.time_validator(start_time, end_time, sec)
         if sec > -1:
-            step_time = start_time
-            delta_time = start_time + datetime.timedelta(seconds=sec)
-            while step_time < end_time:
-                usec_step = int(step_time.strftime("%s") + "000000")
-                usec_delta = int(delta_time.strftime("%s") + "000000")
-
-                if report_type == "overall":
-                    entity_list = self.node_reporter.overall_time_range_report(
-                        usec_step, usec_delta, sort)
-                    self._report_format_printer(
-                        NODES_OVERALL_REPORT_CLI_FIELDS,
-                        entity_list,
-                        step_time.strftime("%Y/%m/%d-%H:%M:%S")
-                    )
-                elif report_type == "iops":
-                    entity_list = self.node_reporter.iops_time_range_report(
-                        usec_step, usec_delta, sort)
-                    self._report_format_printer(
-                        NODES_IOPS_REPORT_CLI_FIELDS,
-                        entity_list,
-                        step_time.strftime("%Y/%m/%d-%H:%M:%S")
-                    )
-                elif report_type == "bw":
-                    entity_list = self.node_reporter.bw_time_range_report(
-                        usec_step, usec_delta, sort)
-                    self._report_format_printer(
-                        NODES_BANDWIDTH_REPORT_CLI_FIELDS,
-                        entity_list,
-                        step_time.strftime("%Y/%m/%d-%H:%M:%S")
-                    )
-                elif report_type == "lat":
-                    entity_list = self.node_reporter.lat_time_range_report(
-                        usec_step, usec_delta, sort)
+            if report_type == "overall":
+                report = self.node_reporter.overall_time_range_buckets
+                cli_fields = NODES_OVERALL_REPORT_CLI_FIELDS
+            elif report_type == "iops":
+                report = self.node_reporter.iops_time_range_buckets
+                cli_fields = NODES_IOPS_REPORT_CLI_FIELDS
+            elif report_type == "bw":
+                report = self.node_reporter.bw_time_range_buckets
+                cli_fields = NODES_BANDWIDTH_REPORT_CLI_FIELDS
+            elif report_type == "lat":
+                report = self.node_reporter.lat_time_range_buckets
+                cli_fields = NODES_LATENCY_REPORT_CLI_FIELDS
+            else:
+                parser.print_usage()
+                sys.stderr.write(
+                    "ERROR: Report type \"{}\" not implmented for nodes.\n"
+                    .format(report_type))
+                return False
+
+            for usec_start, usec_end in self._time_range_windows(
+                    start_time, end_time, sec):
+                for usec_step, entity_list in report(usec_start, usec_end,
+                                                     sec, sort, agg=agg):
                     self._report_format_printer(
-                        NODES_LATENCY_REPORT_CLI_FIELDS,
+                        cli_fields,
                         entity_list,
-                        step_time.strftime("%Y/%m/%d-%H:%M:%S")
+                        self._usecs_to_str(usec_step)
                     )
-                else:
-                    parser.print_usage()
-                    sys.stderr.write(
-                        "ERROR: Report type \"{}\" not implmented for nodes.\n"
-                        .format(report_type))
-                    return False
-
-                step_time = delta_time
-                delta_time += datetime.timedelta(seconds=sec)
             return True
         return False
 
     def uvms_live_report(self, sec, count, sort="name",
-                         node_names=[], report_type="overall"):
+                         node_names=[], report_type="overall", top=None):
         """
-        Print UVMs live report.
+        Print UVMs live report, only the first top VMs when top is given.
         """
+        self._start_snapshot(self.vm_reporter)
         if not sec or sec < 0:
             sec = 0
             count = 1
@@ -1260,12 +3257,12 @@ class UiCli(Ui):
             time_now = datetime.datetime.now().strftime("%Y/%m/%d-%H:%M:%S")
             if report_type == "overall":
                 entity_list = self.vm_reporter.overall_live_report(
-                    sort, node_names)
+                    sort, node_names, top)
                 self._report_format_printer(
                     VM_OVERALL_REPORT_CLI_FIELDS, entity_list, time_now)
             elif report_type == "iops":
                 entity_list = self.vm_reporter.iops_live_report(
-                    sort, node_names)
+                    sort, node_names, top)
                 self._report_format_printer(
                     VM_IOPS_REPORT_CLI_FIELDS, entity_list, time_now)
             else:
@@ -1277,41 +3274,40 @@ class UiCli(Ui):
 
     def uvms_time_range_report(self, start_time, end_time, sec=None,
                                sort="name", node_names=[],
-                               report_type="overall"):
+                               report_type="overall", agg="mean"):
         """
         Print UVMs time range report.
         """
+        self._start_snapshot(self.vm_reporter)
         sec = self.time_validator(start_time, end_time, sec)
         if sec > -1:
-            step_time = start_time
-            delta_time = start_time + datetime.timedelta(seconds=sec)
-            while step_time < end_time:
-                usec_step = int(step_time.strftime("%s") + "000000")
-                usec_delta = int(delta_time.strftime("%s") + "000000")
-
-                if report_type == "overall":
-                    entity_list = self.vm_reporter.overall_time_range_report(
-                        usec_step, usec_delta, sort, node_names)
+            if report_type == "overall":
+                report = self.vm_reporter.overall_time_range_buckets
+                cli_fields = VM_OVERALL_REPORT_CLI_FIELDS
+            else:
+                parser.print_usage()
+                sys.stderr.write(
+                    "ERROR: Report type \"{}\" not implmented for VMs.\n"
+                    .format(report_type))
+                return False
+
+            for usec_start, usec_end in self._time_range_windows(
+                    start_time, end_time, sec):
+                for usec_step, entity_list in report(usec_start, usec_end,
+                                                     sec, sort, node_names,
+                                                     agg):
                     self._report_format_printer(
-                        VM_OVERALL_REPORT_CLI_FIELDS,
+                        cli_fields,
                         entity_list,
-                        step_time.strftime("%Y/%m/%d-%H:%M:%S")
+                        self._usecs_to_str(usec_step)
                     )
-                else:
-                    parser.print_usage()
-                    sys.stderr.write(
-                        "ERROR: Report type \"{}\" not implmented for VMs.\n"
-                        .format(report_type))
-                    return False
-
-                step_time = delta_time
-                delta_time += datetime.timedelta(seconds=sec)
 
     def vg_live_report(self, sec, count, sort="name",
-                       report_type="overall"):
+                       report_type="overall", top=None):
         """
-        Print VGs time range report.
+        Print VGs live report, only the first top VGs when top is given.
         """
+        self._start_snapshot(self.vg_reporter)
         if not sec or sec < 0:
             sec = 0
             count = 1
@@ -1323,7 +3319,8 @@ class UiCli(Ui):
             time.sleep(sec)
             time_now = datetime.datetime.now().strftime("%Y/%m/%d-%H:%M:%S")
             if report_type == "overall":
-                entity_list = self.vg_reporter.overall_live_report(sort)
+                entity_list = self.vg_reporter.overall_live_report(sort,
+                                                                   top)
                 self._report_format_printer(
                     VG_OVERALL_REPORT_CLI_FIELDS, entity_list, time_now)
             else:
@@ -1345,36 +3342,229 @@ class UiCli(Ui):
             .format(report_type))
         return False
 
+    def snapshot_report(self, path, sort="name"):
+        """
+        Print a report saved with --save, sorted by sort.
+        """
+        try:
+            snapshot = ReportSnapshot(path).load()
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("ERROR: Can't load snapshot: {}\n".format(e))
+            return False
+        for frame in snapshot.frames:
+            self._report_format_printer(snapshot.header["fields"],
+                                        snapshot.frame_rows(frame, sort),
+                                        frame[0])
+        return True
 
-class UiInteractive(Ui):
-    """Interactive interface"""
 
-    def __init__(self):
+class LiveStatsSnapshot(object):
+    """
+    Overall live stats of nodes, VMs and VGs fetched together, stamped with
+    the time of the fetch.
+
+    The interactive UI renders every frame of a refresh period from one
+    snapshot. Sorting and filtering VMs by node are done locally and the
+    results are kept, so redraws for key presses or terminal resizes don't
+    query arithmos.
+    """
+
+    def __init__(self, node_reporter, vm_reporter, vg_reporter):
+        self.reporters = {"nodes": node_reporter,
+                          "vms": vm_reporter,
+                          "vgs": vg_reporter}
+        self.time = time.time()
+        self.tables = dict((name, reporter.overall_live_report())
+                           for name, reporter in self.reporters.items())
+        self._views = {}
+
+    def get(self, name, sort="name", node_name=None):
         """
-        TODO:
-          + Find a better way to get Y for pads, the use of overall_live_report()
-            is an unnecessary call to arithmos.
-          + It's not necessary to set the size here. Now it's set dynamically in 
-            the formater function.
+        Returns the entities of name ("nodes", "vms" or "vgs") sorted by
+        sort, only the ones running in node_name if it's set.
+        """
+        view_key = (name, sort, node_name)
+        view = self._views.get(view_key)
+        if view is None:
+            view = self.tables[name]
+            if node_name is not None:
+                view = view.filter("node_name", node_name)
+            view = self.reporters[name]._sort_entity_dict(view, sort)
+            self._views[view_key] = view
+        return view
+
+
+class LiveStatsPoller(object):
+    """
+    Fetch LiveStatsSnapshots from a background thread every interval
+    seconds, so the interactive UI keeps handling keys and redrawing while
+    a query to arithmos is in flight. With adaptive the period is
+    stretched when the last fetch took more than
+    INTERACTIVE_MAX_FETCH_SHARE of it, see period().
+
+    Snapshots are published by replacing the snapshot attribute, they are
+    never modified after that, readers only take the latest one. When a
+    poll fails the error is kept in error and the previous snapshot stays
+    published. Every change of the status is notified writing to a pipe,
+    notify_fd, that readers can wait on with select().
+    """
+
+    def __init__(self, node_reporter, vm_reporter, vg_reporter,
+                 interval=INTERACTIVE_REFRESH_SECS, adaptive=True):
+        self.reporters = (node_reporter, vm_reporter, vg_reporter)
+        self.interval = interval
+        self.adaptive = adaptive
+        self.snapshot = None
+        self.published = None
+        self.error = None
+        self.in_flight = False
+        self.fetch_time = 0
+        self.poll_start = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.notify_fd = None
+        self._notify_w = None
+
+    def poll(self):
+        """
+        Fetch and publish a snapshot in the calling thread.
+        """
+        self.in_flight = True
+        self._notify()
+        self.poll_start = time.time()
+        start = timeit.default_timer()
+        try:
+            self.snapshot = LiveStatsSnapshot(*self.reporters)
+            self.published = time.time()
+            self.error = None
+        finally:
+            self.fetch_time = timeit.default_timer() - start
+            self.in_flight = False
+            self._notify()
+        return self.snapshot
+
+    def _notify(self):
+        if self._notify_w is None:
+            return
+        try:
+            os.write(self._notify_w, b".")
+        except OSError:
+            # The pipe is full, the reader has notifications pending.
+            pass
+
+    def clear_notifications(self):
+        try:
+            os.read(self.notify_fd, 4096)
+        except OSError:
+            pass
+
+    def period(self):
+        """
+        Returns the seconds between the start of two polls.
         """
-        Ui.__init__(self)
+        if self.adaptive:
+            return max(self.interval,
+                       self.fetch_time / INTERACTIVE_MAX_FETCH_SHARE)
+        return self.interval
 
-        self.stdscr = curses.initscr()
+    def set_interval(self, interval=None, adaptive=None):
+        """
+        Change the refresh interval, within INTERACTIVE_MIN_REFRESH_SECS and
+        INTERACTIVE_MAX_REFRESH_SECS, or the adaptive mode. The next poll is
+        rescheduled.
+        """
+        if interval is not None:
+            self.interval = min(max(interval, INTERACTIVE_MIN_REFRESH_SECS),
+                                INTERACTIVE_MAX_REFRESH_SECS)
+        if adaptive is not None:
+            self.adaptive = adaptive
+        self._wake.set()
+
+    def status_deadline(self):
+        """
+        Returns the seconds until status() changes without a notification,
+        i.e. until the snapshot becomes stale or its age changes.
+        """
+        remaining = (self.published +
+                     self.period() * INTERACTIVE_STALE_REFRESHES - time.time())
+        if self.error or remaining <= 0:
+            # The age shown with "stale" changes every second.
+            return 1
+        return remaining
+
+    def start(self):
+        self.notify_fd, self._notify_w = os.pipe()
+        for fd in (self.notify_fd, self._notify_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._thread = threading.Thread(target=self._poll_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # A query in flight is not waited for, the thread is a daemon.
+        self._stopped = True
+        self._wake.set()
+
+    def _poll_loop(self):
+        while not self._stopped:
+            # The deadline is computed again when woken up by
+            # set_interval() or stop().
+            timeout = self.poll_start + self.period() - time.time()
+            if timeout > 0:
+                self._wake.wait(timeout)
+                self._wake.clear()
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                self.error = e
+                self._notify()
+
+    def status(self):
+        """
+        Returns a short status for the header: "stale <age>s" when the
+        last poll failed or no snapshot was published for
+        INTERACTIVE_STALE_REFRESHES refresh periods, "updating" while a
+        query is in flight, "" otherwise.
+        """
+        now = time.time()
+        if self.error or (now - self.published >
+                          self.period() * INTERACTIVE_STALE_REFRESHES):
+            return "stale {:.0f}s".format(now - self.snapshot.time)
+        if self.in_flight:
+            return "updating"
+        return ""
+
+
+class UiInteractive(Ui):
+    """Interactive interface"""
+
+    def __init__(self, jobs=DEFAULT_JOBS, datasource=None, stats=None,
+                 sec=None):
+        _import_curses()
+        Ui.__init__(self, jobs, datasource=datasource, stats=stats)
 
-        self.help_widget_pad = curses.newpad(14, 30)
-        self.help_widget_pad.border()
+        self.render_time = 0
+        self.status = ""
+        self.poller = LiveStatsPoller(self.node_reporter, self.vm_reporter,
+                                      self.vg_reporter)
+        if sec and sec > 0:
+            self.poller.set_interval(sec)
+        self.refresh_live_stats()
 
-        self.nodes_cpu_pad = curses.newpad(
-            len(self.node_reporter.overall_live_report()) + 3, 87)
-        self.nodes_cpu_pad.border()
+        self.stdscr = curses.initscr()
 
-        self.nodes_io_pad = curses.newpad(
-            len(self.node_reporter.overall_live_report()) + 3, 87)
-        self.nodes_io_pad.border()
+        # Pads are created on first use and reused, see _get_pad(). The
+        # lines written in every pad are kept to skip unchanged ones.
+        self.pads = {}
+        self._pad_lines = {}
 
-        self.entities_pad = curses.newpad(
-            len(self.vm_reporter.overall_live_report()) + 3, 87)
-        self.entities_pad.border()
+        # First entity shown in the VMs and VGs lists and number of rows
+        # that fit on the screen, see scroll_entities().
+        self.scroll = {"vms": 0, "vgs": 0}
+        self.entities_page = 1
 
         self.initialize_colors()
         self.initialize_strings()
@@ -1517,6 +3707,26 @@ class UiInteractive(Ui):
         elif toggle_key == ord('v'):
             self.entities_pad_to_display = "vm"
 
+    def scroll_entities(self, scroll_key):
+        name = self.entities_pad_to_display + "s"
+        if scroll_key == curses.KEY_NPAGE:
+            self.scroll[name] += self.entities_page
+        elif scroll_key == curses.KEY_PPAGE:
+            self.scroll[name] -= self.entities_page
+        elif scroll_key == curses.KEY_HOME:
+            self.scroll[name] = 0
+        elif scroll_key == curses.KEY_END:
+            # Clamped to the last page when the list is rendered.
+            self.scroll[name] = sys.maxsize
+
+    def change_refresh(self, refresh_key):
+        if refresh_key in (ord('+'), ord('=')):
+            self.poller.set_interval(self.poller.interval + 1)
+        elif refresh_key == ord('-'):
+            self.poller.set_interval(self.poller.interval - 1)
+        elif refresh_key == ord('a'):
+            self.poller.set_interval(adaptive=not self.poller.adaptive)
+
     def toggle_help_pad(self, toggle_key):
         if toggle_key == ord('h'):
             if self.help_pad_to_display == "none":
@@ -1533,6 +3743,8 @@ class UiInteractive(Ui):
         self.toggle_active_node(self.key)
         self.toggle_entities_pad(self.key)
         self.toggle_help_pad(self.key)
+        self.scroll_entities(self.key)
+        self.change_refresh(self.key)
 
     def render_header(self):
         # Turning on attributes for title
@@ -1542,376 +3754,1170 @@ class UiInteractive(Ui):
         # Rendering title
         self.stdscr.addstr(0, 5, self.title)
         self.stdscr.addstr(0, self.width - 12,
-                           datetime.datetime.now().strftime(" %H:%M:%S "))
+                           datetime.datetime.fromtimestamp(self.live.time)
+                           .strftime(" %H:%M:%S "))
+        if self.width > 60:
+            self.stdscr.addstr(0, self.width - 44,
+                               " fetch {:>5.0f}ms render {:>4.0f}ms ".format(
+                                   self.poller.fetch_time * 1000,
+                                   self.render_time * 1000))
+        if self.status and self.width > 75:
+            self.stdscr.addstr(0, self.width - 58,
+                               " {:>11} ".format(self.status))
+        if self.width > 95:
+            self.stdscr.addstr(0, self.width - 77,
+                               " every {:>2.0f}s {:<4} ".format(
+                                   math.ceil(self.poller.period()),
+                                   "auto" if self.poller.adaptive else ""))
 
         # Turning off attributes for title
         self.stdscr.attroff(curses.color_pair(self.RED))
         self.stdscr.attroff(curses.A_BOLD)
 
+    def _get_pad(self, name, height, width):
+        """
+        Returns the pad name with size height x width. Pads are kept
+        between frames, a pad is only erased and its border drawn when it
+        is created or its size changes.
+        """
+        pad = self.pads.get(name)
+        if pad is not None and pad.getmaxyx() == (height, width):
+            return pad
+        if pad is None:
+            pad = curses.newpad(height, width)
+            self.pads[name] = pad
+        else:
+            pad.resize(height, width)
+        pad.erase()
+        pad.border()
+        self._pad_lines[name] = {}
+        return pad
+
+    def _pad_addstr(self, name, y, x, text, attr=0):
+        """
+        Write text in the pad name unless the same text, with the same
+        attributes, was written there in a previous frame.
+        """
+        lines = self._pad_lines[name]
+        previous = lines.get((y, x))
+        if previous == (text, attr):
+            return
+        lines[(y, x)] = (text, attr)
+        pad = self.pads[name]
+        if previous is not None and len(previous[0]) > len(text):
+            # Erase the previous text, it may have covered the border, and
+            # write again the text on the top and bottom borders.
+            pad.addstr(y, x, " " * len(previous[0]))
+            pad.border()
+            borders = (0, pad.getmaxyx()[0] - 1)
+            for (line_y, line_x), (line_text, line_attr) in lines.items():
+                if line_y in borders and (line_y, line_x) != (y, x):
+                    pad.addstr(line_y, line_x, line_text, line_attr)
+        pad.addstr(y, x, text, attr)
+
     def render_help_pad(self, y, x):
         self.stdscr.noutrefresh()
-        pad_size_y, pad_size_x = self.help_widget_pad.getmaxyx()
-
-        self.help_widget_pad.attron(curses.A_BOLD)
-        self.help_widget_pad.addstr(0, 3, " Hotkeys ")
-        self.help_widget_pad.attroff(curses.A_BOLD)
-
-        self.help_widget_pad.addstr(1,  1, "~~~ PADs ~~~~~~~~~~~~~~~~~~~")
-        self.help_widget_pad.addstr(2,  1, "n:   Toggle node pad")
-        self.help_widget_pad.addstr(3,  1, "v:   Virtual machines pad")
-        self.help_widget_pad.addstr(4,  1, "g:   Volume group pad")
-        self.help_widget_pad.addstr(5,  1, "TAB: Filter VMs by nodes")
-        self.help_widget_pad.addstr(7,  1, "~~~ Sort ~~~~~~~~~~~~~~~~~~~")
-        self.help_widget_pad.addstr(8,  1, "VM/VG: (c)pu, (r)dy , (m)em")
-        self.help_widget_pad.addstr(9,  1, "       (i)ops, (b)/w, (l)at")
-        self.help_widget_pad.addstr(10,  1, "Nodes: (N)ame, (C)pu, (I)OPS")
-        self.help_widget_pad.addstr(11, 1, "       (B)/W, (L)AT")
-
-        self.safe_noautorefresh(self.help_widget_pad, 0, 0, y, x,
+        pad = self._get_pad("help", 16, 30)
+        pad_size_y, pad_size_x = pad.getmaxyx()
+
+        self._pad_addstr("help", 0, 3, " Hotkeys ", curses.A_BOLD)
+
+        self._pad_addstr("help", 1,  1, "~~~ PADs ~~~~~~~~~~~~~~~~~~~")
+        self._pad_addstr("help", 2,  1, "n:   Toggle node pad")
+        self._pad_addstr("help", 3,  1, "v:   Virtual machines pad")
+        self._pad_addstr("help", 4,  1, "g:   Volume group pad")
+        self._pad_addstr("help", 5,  1, "TAB: Filter VMs by nodes")
+        self._pad_addstr("help", 7,  1, "~~~ Sort ~~~~~~~~~~~~~~~~~~~")
+        self._pad_addstr("help", 8,  1, "VM/VG: (c)pu, (r)dy , (m)em")
+        self._pad_addstr("help", 9,  1, "       (i)ops, (b)/w, (l)at")
+        self._pad_addstr("help", 10,  1, "Nodes: (N)ame, (C)pu, (I)OPS")
+        self._pad_addstr("help", 11, 1, "       (B)/W, (L)AT")
+        self._pad_addstr("help", 12, 1, "PgUp/PgDn/Home/End: Scroll")
+        self._pad_addstr("help", 13, 1, "+/-: Refresh period")
+        self._pad_addstr("help", 14, 1, "a:   Adaptive refresh")
+
+        self.safe_noautorefresh(pad, 0, 0, y, x,
                                 pad_size_y, pad_size_x)
 
+    def _node_attr(self, node):
+        if node["node_name"] == self.active_node:
+            return curses.color_pair(self.BLACK_WHITE) | curses.A_BOLD
+        return 0
+
     def render_nodes_cpu_pad(self, y, x):
         self.stdscr.noutrefresh()
-        pad_size_y, pad_size_x = self.nodes_cpu_pad.getmaxyx()
+        self.nodes = self.live.get("nodes", self.nodes_sort)
+        pad = self._get_pad("nodes_cpu", len(self.nodes) + 3, 87)
+        pad_size_y, pad_size_x = pad.getmaxyx()
 
-        self.nodes_cpu_pad.attron(curses.A_BOLD)
-        self.nodes_cpu_pad.addstr(0, 3, " Nodes CPU ")
-        self.nodes_cpu_pad.attroff(curses.A_BOLD)
+        self._pad_addstr("nodes_cpu", 0, 3, " Nodes CPU ", curses.A_BOLD)
 
-        self.nodes_cpu_pad.addstr(0, pad_size_x - 15, " Sort: {0:<4} "
-                                  .format(self.nodes_sort))
+        self._pad_addstr("nodes_cpu", 0, pad_size_x - 15, " Sort: {0:<4} "
+                         .format(self.nodes_sort))
 
-        self.nodes_cpu_pad.attron(curses.A_BOLD)
+        self._pad_addstr("nodes_cpu", 1, 1, "{0:<20} {1:>6} {2:>6}|{3:50}"
+                         .format("Name",
+                                 "MEM%",
+                                 "CPU%",
+                                 "0%         |25%         |50%        |75%     100%|"),
+                         curses.A_BOLD)
 
-        self.nodes_cpu_pad.addstr(1, 1, "{0:<20} {1:>6} {2:>6}|{3:50}"
-                                  .format("Name",
-                                          "MEM%",
-                                          "CPU%",
-                                          "0%         |25%         |50%        |75%     100%|"))
-
-        self.nodes_cpu_pad.attroff(curses.A_BOLD)
-
-        self.nodes = self.node_reporter.overall_live_report(self.nodes_sort)
         for i in range(0, len(self.nodes)):
             node = self.nodes[i]
             rangex = int(0.5 * node["hypervisor_cpu_usage_percent"])
 
-            if node["node_name"] == self.active_node:
-                self.nodes_cpu_pad.attron(curses.color_pair(self.BLACK_WHITE))
-                self.nodes_cpu_pad.attron(curses.A_BOLD)
+            self._pad_addstr("nodes_cpu", i + 2, 1,
+                             "{0:<20} {1:>6.2f} {2:>6.2f}|{3:50}"
+                             .format(node["node_name"][:20],
+                                     node["hypervisor_memory_usage_percent"],
+                                     node["hypervisor_cpu_usage_percent"],
+                                     "#" * rangex),
+                             self._node_attr(node))
 
-            self.nodes_cpu_pad.addstr(i + 2, 1, "{0:<20} {1:>6.2f} {2:>6.2f}|{3:50}"
-                                      .format(node["node_name"][:20],
-                                              node["hypervisor_memory_usage_percent"],
-                                              node["hypervisor_cpu_usage_percent"],
-                                              "#" * rangex))
-            if node["node_name"] == self.active_node:
-                self.nodes_cpu_pad.attroff(curses.color_pair(self.BLACK_WHITE))
-                self.nodes_cpu_pad.attroff(curses.A_BOLD)
-
-        self.safe_noautorefresh(self.nodes_cpu_pad, 0, 0, y, x,
+        self.safe_noautorefresh(pad, 0, 0, y, x,
                                 pad_size_y, pad_size_x)
         return y + pad_size_y
 
     def render_nodes_io_pad(self, y, x):
         self.stdscr.noutrefresh()
-        pad_size_y, pad_size_x = self.nodes_cpu_pad.getmaxyx()
-
-        self.nodes_io_pad.attron(curses.A_BOLD)
-        self.nodes_io_pad.addstr(0, 3, " Nodes IOPs ")
-        self.nodes_io_pad.attroff(curses.A_BOLD)
+        self.nodes = self.live.get("nodes", self.nodes_sort)
+        pad = self._get_pad("nodes_io", len(self.nodes) + 3, 87)
+        pad_size_y, pad_size_x = pad.getmaxyx()
 
-        self.nodes_io_pad.addstr(0, pad_size_x - 15, " Sort: {0:<4} "
-                                 .format(self.nodes_sort))
+        self._pad_addstr("nodes_io", 0, 3, " Nodes IOPs ", curses.A_BOLD)
 
-        self.nodes_io_pad.attron(curses.A_BOLD)
+        self._pad_addstr("nodes_io", 0, pad_size_x - 15, " Sort: {0:<4} "
+                         .format(self.nodes_sort))
 
-        self.nodes_io_pad.addstr(1, 1, "{0:<20} {1:>8} {2:>8} {3:>8} {4:>8} {5:>6}"
-                                 .format("Name",
-                                         "cIOPs",
-                                         "hIOPs",
-                                         "IOPs",
-                                         "B/W[MB]",
-                                         "Lat[ms]"))
+        self._pad_addstr("nodes_io", 1, 1,
+                         "{0:<20} {1:>8} {2:>8} {3:>8} {4:>8} {5:>6}"
+                         .format("Name",
+                                 "cIOPs",
+                                 "hIOPs",
+                                 "IOPs",
+                                 "B/W[MB]",
+                                 "Lat[ms]"),
+                         curses.A_BOLD)
 
-        self.nodes_io_pad.attroff(curses.A_BOLD)
-
-        self.nodes = self.node_reporter.overall_live_report(self.nodes_sort)
         for i in range(0, len(self.nodes)):
             node = self.nodes[i]
 
-            if node["node_name"] == self.active_node:
-                self.nodes_io_pad.attron(curses.color_pair(self.BLACK_WHITE))
-                self.nodes_io_pad.attron(curses.A_BOLD)
-
-            self.nodes_io_pad.addstr(i + 2, 1, "{0:<20} {1:>8} {2:>8} "
-                                     "{3:>8} {4:>8.2f} {5:>6.2f}"
-                                     .format(node["node_name"][:20],
-                                             node["controller_num_iops"],
-                                             node["hypervisor_num_iops"],
-                                             node["num_iops"],
-                                             node["io_bandwidth_mBps"],
-                                             node["avg_io_latency_msecs"]))
-
-            if node["node_name"] == self.active_node:
-                self.nodes_io_pad.attroff(curses.color_pair(self.BLACK_WHITE))
-                self.nodes_io_pad.attroff(curses.A_BOLD)
-
-        self.safe_noautorefresh(self.nodes_io_pad, 0, 0, y, x,
+            self._pad_addstr("nodes_io", i + 2, 1,
+                             "{0:<20} {1:>8} {2:>8} "
+                             "{3:>8} {4:>8.2f} {5:>6.2f}"
+                             .format(node["node_name"][:20],
+                                     node["controller_num_iops"],
+                                     node["hypervisor_num_iops"],
+                                     node["num_iops"],
+                                     node["io_bandwidth_mBps"],
+                                     node["avg_io_latency_msecs"]),
+                             self._node_attr(node))
+
+        self.safe_noautorefresh(pad, 0, 0, y, x,
                                 pad_size_y, pad_size_x)
         return y + pad_size_y
 
-    def _render_entity_list(self, y, x, field_list, entity_list,
+    def _render_entity_list(self, y, x, name, field_list, entity_list,
                             title, title_sort, highlight_header=False):
         """
-        Helper method to print entities lists.
+        Helper method to print entities lists in the pad name.
+
+        The pad is a viewport of the rows that fit on the screen, starting
+        at self.scroll[name], only those rows are formatted. The position
+        in the list is shown in the bottom border.
         """
-        header_format_string = ""
-        entity_format_string = ""
-        for i in range(len(field_list)):
-            header_format_string += ("{" +
-                                     str(i) + ":" +
-                                     field_list[i]["align"] +
-                                     str(field_list[i]["width"]) +
-                                     "} "
-                                     )
-            entity_format_string += ("{" +
-                                     str(i) + ":" +
-                                     field_list[i]["align"] +
-                                     str(field_list[i]["width"]) +
-                                     field_list[i]["format"] +
-                                     "} "
-                                     )
-        header_list = []
-        for i in range(len(field_list)):
-            header_list.append(field_list[i]["header"])
+        formatter = self._get_row_formatter(field_list)
+        total = len(entity_list)
+        # Rows between the pad borders and header, above the screen border.
+        visible = max(0, min(total, self.height - y - 4))
+        self.entities_page = max(1, visible)
+        start = max(0, min(self.scroll[name], total - visible))
+        self.scroll[name] = start
+        rows = formatter.rows(entity_list, start, start + visible)
 
         self.stdscr.noutrefresh()
-        self.entities_pad.clear()
-
-        self.entities_pad = curses.newpad(
-            len(entity_list) + 3, len(header_format_string.format(*header_list)) + 3)
-        self.entities_pad.border()
+        pad = self._get_pad(name, visible + 3, len(formatter.header) + 3)
+        pad_size_y, pad_size_x = pad.getmaxyx()
 
-        pad_size_y, pad_size_x = self.entities_pad.getmaxyx()
+        self._pad_addstr(name, 0, 3, " " + title + " ", curses.A_BOLD)
 
-        self.entities_pad.attron(curses.A_BOLD)
-        self.entities_pad.addstr(0, 3, " " + title + " ")
-        self.entities_pad.attroff(curses.A_BOLD)
-
-        self.entities_pad.addstr(0, pad_size_x - 15, title_sort)
+        self._pad_addstr(name, 0, pad_size_x - 15, title_sort)
 
         # Print header
+        header_attr = curses.A_BOLD
         if highlight_header:
-            self.entities_pad.attron(curses.color_pair(self.BLACK_WHITE))
-        self.entities_pad.attron(curses.A_BOLD)
-        self.entities_pad.addstr(
-            1, 2, header_format_string.format(*header_list))
-        self.entities_pad.attroff(curses.A_BOLD)
-        if highlight_header:
-            self.entities_pad.attroff(curses.color_pair(self.BLACK_WHITE))
-
-        # Print entities list
-        for line_num in range(0, len(entity_list)):
-            entity = entity_list[line_num]
-            entity_stat_list = []
-            for i in range(len(field_list)):
-                stat_key = field_list[i]["key"]
-                stat_value = entity[stat_key]
-                entity_stat_list.append(stat_value)
-            self.entities_pad.addstr(
-                line_num + 2, 2, entity_format_string.format(*entity_stat_list))
-
-        self.safe_noautorefresh(self.entities_pad, 0, 0, y, x,
+            header_attr |= curses.color_pair(self.BLACK_WHITE)
+        self._pad_addstr(name, 1, 2, formatter.header, header_attr)
+
+        # Print entities list, only rows that changed are written.
+        for line_num, row in enumerate(rows):
+            self._pad_addstr(name, line_num + 2, 2, row)
+
+        if visible:
+            position = " {}-{}/{} ".format(start + 1, start + visible, total)
+        else:
+            position = " 0/{} ".format(total)
+        self._pad_addstr(name, pad_size_y - 1, 3, position)
+
+        self.safe_noautorefresh(pad, 0, 0, y, x,
                                 pad_size_y, pad_size_x)
         return y + pad_size_y
 
     def render_vg_list(self, y, x):
 
-        vgs = self.vg_reporter.overall_live_report(self.vg_sort)
+        vgs = self.live.get("vgs", self.vg_sort)
 
         return self._render_entity_list(
-            y, x, VG_OVERALL_REPORT_CLI_FIELDS, vgs, "Volume Groups",
+            y, x, "vgs", VG_OVERALL_REPORT_CLI_FIELDS, vgs, "Volume Groups",
             " Sort: {0:<4} ".format(self.vg_sort))
 
     def render_vm_list(self, y, x):
         if self.active_node:
-            vms = self.vm_reporter.overall_live_report(
-                self.vm_sort, [self.active_node])
+            vms = self.live.get("vms", self.vm_sort, self.active_node)
             highlight_header = True
         else:
-            vms = self.vm_reporter.overall_live_report(
-                self.vm_sort)
+            vms = self.live.get("vms", self.vm_sort)
             highlight_header = False
 
         return self._render_entity_list(
-            y, x, VM_OVERALL_REPORT_CLI_FIELDS, vms, "Virtual Machines",
+            y, x, "vms", VM_OVERALL_REPORT_CLI_FIELDS, vms, "Virtual Machines",
             " Sort: {0:<4} ".format(self.vm_sort), highlight_header)
 
-    def render_main_screen(self, stdscr):
-        self.stdscr.clear()
-        self.stdscr.nodelay(1)
-
-        # Set invisible cursor
-        curses.curs_set(0)
+    def refresh_live_stats(self):
+        """
+        Fetch a new LiveStatsSnapshot in the calling thread, frames are
+        drawn from it until the next refresh. The time spent fetching is
+        shown in the header.
+        """
+        self.live = self.poller.poll()
 
-        refresh_time = datetime.datetime.now() - datetime.timedelta(0, 2)
-        while (self.key != ord('q')):
+    def render_frame(self):
+        """
+        Draw a whole screen from the current snapshot. The time spent
+        rendering is shown in the header of the next frame.
+        """
+        start = timeit.default_timer()
+        with self.stats.phase("format"):
+            self._render_frame()
+        self.render_time = timeit.default_timer() - start
+
+    def _render_frame(self):
+        current_y_position = 2
+
+        # Initialization. Only a new terminal size repaints the whole
+        # terminal, otherwise curses sends the cells that changed.
+        height, width = self.stdscr.getmaxyx()
+        if (height, width) != (self.height, self.width):
+            self.stdscr.clear()
+        else:
+            self.stdscr.erase()
+        self.height, self.width = height, width
+        self.stdscr.border()
 
-            self.handle_key_press()
+        self.render_header()
 
-            if refresh_time < datetime.datetime.now() or self.key != -1:
-                current_y_position = 2
+        # Display help pad
+        if self.help_pad_to_display == "widget":
+            self.render_help_pad(2, 88)
 
-                # Initialization
-                self.stdscr.clear()
-                self.height, self.width = stdscr.getmaxyx()
-                self.stdscr.border()
+        # Display nodes pad
+        if current_y_position < self.height:
+            if self.nodes_pad == "cpu":
+                current_y_position = self.render_nodes_cpu_pad(
+                    current_y_position, 1)
+            elif self.nodes_pad == "iops":
+                current_y_position = self.render_nodes_io_pad(
+                    current_y_position, 1)
+
+        # Display entities pad
+        if current_y_position < self.height - 2:
+            if self.entities_pad_to_display == "vm":
+                current_y_position = self.render_vm_list(
+                    current_y_position, 1)
+            elif self.entities_pad_to_display == "vg":
+                current_y_position = self.render_vg_list(
+                    current_y_position, 1)
+
+        # Refresh the screen
+        self.stdscr.noutrefresh()
 
-                self.render_header()
+        # Stage all updates
+        curses.doupdate()
 
-                # Display help pad
-                if self.help_pad_to_display == "widget":
-                    self.render_help_pad(2, 88)
+    def render_main_screen(self, stdscr):
+        self.stdscr.clear()
+        self.stdscr.nodelay(1)
+        self.stdscr.keypad(1)
 
-                # Display nodes pad
-                if current_y_position < self.height:
-                    if self.nodes_pad == "cpu":
-                        current_y_position = self.render_nodes_cpu_pad(
-                            current_y_position, 1)
-                    elif self.nodes_pad == "iops":
-                        current_y_position = self.render_nodes_io_pad(
-                            current_y_position, 1)
+        # Set invisible cursor
+        curses.curs_set(0)
 
-                # Display entities pad
-                if current_y_position < self.height - 2:
-                    if self.entities_pad_to_display == "vm":
-                        current_y_position = self.render_vm_list(
-                            current_y_position, 1)
-                    elif self.entities_pad_to_display == "vg":
-                        current_y_position = self.render_vg_list(
-                            current_y_position, 1)
+        # The first frame is drawn from the snapshot taken at start, new
+        # snapshots are fetched by the poller thread.
+        self.render_frame()
+        self.poller.start()
+        try:
+            while (self.key != ord('q')):
+
+                self.wait_for_event()
+
+                # Handle every pending key before drawing.
+                pressed = False
+                self.handle_key_press()
+                while self.key not in (-1, ord('q')):
+                    pressed = True
+                    self.handle_key_press()
+
+                snapshot = self.poller.snapshot
+                status = self.poller.status()
+                if (snapshot is not self.live or status != self.status or
+                        pressed):
+                    self.live = snapshot
+                    self.status = status
+                    self.render_frame()
+        finally:
+            self.poller.stop()
+
+    def wait_for_event(self):
+        """
+        Block until a key is pressed, the poller notifies a change or the
+        status of the poller is due to change. Waits at most
+        INTERACTIVE_MAX_WAIT_SECS seconds.
+        """
+        timeout = min(self.poller.status_deadline(), INTERACTIVE_MAX_WAIT_SECS)
+        try:
+            ready, _, _ = select.select(
+                [sys.stdin, self.poller.notify_fd], [], [], timeout)
+        except select.error:
+            # Interrupted by a signal, e.g. SIGWINCH on terminal resizes
+            # with Python 2, getch() returns KEY_RESIZE.
+            return
+        if self.poller.notify_fd in ready:
+            self.poller.clear_notifications()
+
+
+class ExportFile(object):
+    """
+    Line protocol export file with optional streaming compression and
+    rotation.
+
+    Files are named after prefix:
+
+      <prefix>[.<time bucket>][.<sequence>].line[.gz|.xz]
+
+    With rotate_time ("hour" or "day") a new file is started for every
+    hour or day of data, based on the timestamp of the datapoints. With
+    rotate_size_mb a new file is started when the current one, as written
+    to disk after compression, reaches that size. When the export file is
+    closed a manifest <prefix>.manifest is written in JSON with the list
+    of produced files.
+    """
+
+    EXTENSIONS = {None: "", "gzip": ".gz", "xz": ".xz"}
+    TIME_BUCKET_FORMATS = {"hour": "%Y%m%d%H", "day": "%Y%m%d"}
+
+    def __init__(self, prefix, compress=None, rotate_size_mb=None,
+                 rotate_time=None):
+        if compress == "xz" and _import_optional("lzma") is None:
+            raise ValueError("xz compression needs the lzma module")
+        _import_serialization()
+        self.prefix = prefix
+        self.compress = compress
+        self.rotate_size = rotate_size_mb * 1048576 if rotate_size_mb else None
+        self.rotate_time = rotate_time
+        self.manifest = "{}.manifest".format(prefix)
+        self.files = []
+        self.raw_file = None
+        self.file = None
+        self.bucket = None
+
+    def time_bucket(self, usecs):
+        """
+        Returns the time bucket for a datapoint timestamp, None if files
+        are not rotated by time.
+        """
+        if not self.rotate_time:
+            return None
+        return datetime.datetime.fromtimestamp(usecs // 1000000).strftime(
+            self.TIME_BUCKET_FORMATS[self.rotate_time])
+
+    def set_time_bucket(self, bucket):
+        if bucket != self.bucket:
+            self._close_current()
+            self.bucket = bucket
+
+    def _next_name(self):
+        name = self.prefix
+        if self.bucket:
+            name += "." + self.bucket
+        if self.rotate_size:
+            sequence = len([f for f in self.files
+                            if f["time_bucket"] == self.bucket])
+            name += ".{}".format(sequence)
+        return name + ".line" + self.EXTENSIONS[self.compress]
+
+    def _open_next(self):
+        name = self._next_name()
+        self.raw_file = open(name, "ab")
+        if self.compress == "gzip":
+            import gzip
+            self.file = gzip.GzipFile(fileobj=self.raw_file, mode="wb")
+        elif self.compress == "xz":
+            self.file = _import_optional("lzma").LZMAFile(self.raw_file,
+                                                          mode="wb")
+        else:
+            self.file = self.raw_file
+        self.files.append({"name": name, "time_bucket": self.bucket,
+                           "lines": 0, "bytes": 0})
+
+    def _close_current(self):
+        if self.file is not None:
+            if self.file is not self.raw_file:
+                self.file.close()
+            self.files[-1]["bytes"] = self.raw_file.tell()
+            self.raw_file.close()
+            self.file = None
+            self.raw_file = None
+
+    def write(self, data, lines=0):
+        if self.file is not None and self.rotate_size and \
+                self.raw_file.tell() >= self.rotate_size:
+            self._close_current()
+        if self.file is None:
+            self._open_next()
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.file.write(data)
+        self.files[-1]["lines"] += lines
+
+    def close(self):
+        self._close_current()
+        with open(self.manifest, "w") as manifest_file:
+            json.dump({"prefix": self.prefix,
+                       "compress": self.compress,
+                       "files": self.files}, manifest_file, indent=2)
+
+
+class InfluxWriteError(Exception):
+    pass
+
+
+class InfluxWriteSink(object):
+    """
+    Push line protocol batches to an InfluxDB compatible HTTP write
+    endpoint, e.g.:
+
+      http://influx:8086/api/v2/write?org=narf&bucket=narf
+
+    Datapoints are timestamped in microseconds, precision=us is added to
+    the URL when it doesn't set a precision. Batches are queued and sent
+    from a background thread over a single keep-alive connection, the queue
+    holds up to max_in_flight batches so a slow endpoint doesn't stall the
+    collection until the queue is full. Connection errors, 429 and 5xx
+    responses are retried with exponential backoff, other responses are
+    errors. Errors are raised as InfluxWriteError on the next write() or on
+    close().
+
+    Implements the same interface than ExportFile for BufferedLineWriter.
+    """
+
+    def __init__(self, url, token=None, max_in_flight=INFLUX_MAX_IN_FLIGHT,
+                 retries=INFLUX_RETRIES, timeout=INFLUX_TIMEOUT_SECS):
+        _import_http()
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise InfluxWriteError("Invalid URL: {}".format(url))
+        self.url = url
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or "/"
+        query = parsed.query
+        if "precision=" not in query:
+            query = query + "&precision=us" if query else "precision=us"
+        self.path += "?" + query
+
+        self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if token:
+            self.headers["Authorization"] = "Token {}".format(token)
+
+        self.retries = retries
+        self.timeout = timeout
+        self.connection = None
+        self.error = None
+        self.bucket = None
+        self.batches = 0
+        self.lines = 0
+
+        self.queue = queue.Queue(maxsize=max(1, max_in_flight))
+        self.sender = threading.Thread(target=self._send_loop)
+        self.sender.daemon = True
+        self.sender.start()
+
+    def time_bucket(self, usecs):
+        return None
+
+    def set_time_bucket(self, bucket):
+        pass
 
-                # Refresh the screen
-                self.stdscr.noutrefresh()
+    def write(self, data, lines=0):
+        if self.error:
+            raise self.error
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.queue.put((data, lines))
+
+    def close(self):
+        self.queue.put(None)
+        self.sender.join()
+        self._close_connection()
+        if self.error:
+            raise self.error
+
+    def _get_connection(self):
+        if self.connection is None:
+            if self.https:
+                self.connection = httplib.HTTPSConnection(
+                    self.host, self.port, timeout=self.timeout)
+            else:
+                self.connection = httplib.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout)
+        return self.connection
 
-                # Stage all updates
-                curses.doupdate()
+    def _close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
 
-                # Calculate time for next screen refresh.
-                # TODO: Enable hability to change refresh rate.
-                refresh_time = datetime.datetime.now() + datetime.timedelta(0, 3)
+    def _post(self, data):
+        """
+        Send a batch. Returns True when it's written, False when it needs
+        to be retried.
+        """
+        try:
+            connection = self._get_connection()
+            connection.request("POST", self.path, data, self.headers)
+            response = connection.getresponse()
+            # The body needs to be read to reuse the connection.
+            body = response.read()
+        except (socket.error, httplib.HTTPException):
+            self._close_connection()
+            return False
+
+        if 200 <= response.status < 300:
+            return True
+        if response.status == 429 or response.status >= 500:
+            return False
+        if not isinstance(body, str):
+            body = body.decode("utf-8", "replace")
+        raise InfluxWriteError("Write to {} failed with HTTP {}: {}".format(
+            self.url, response.status, body[:200]))
+
+    def _send_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error:
+                # Drain the queue, the error is raised in the main thread.
+                continue
+            data, lines = item
+            try:
+                backoff = INFLUX_RETRY_BACKOFF_SECS
+                for attempt in range(self.retries + 1):
+                    if self._post(data):
+                        self.batches += 1
+                        self.lines += lines
+                        break
+                    if attempt < self.retries:
+                        time.sleep(backoff)
+                        backoff *= 2
+                else:
+                    raise InfluxWriteError(
+                        "Write to {} failed after {} retries".format(
+                            self.url, self.retries))
+            except InfluxWriteError as e:
+                self.error = e
+            except Exception as e:
+                # Anything else would kill the thread and leave write() and
+                # close() waiting on the queue forever.
+                self.error = InfluxWriteError(
+                    "Write to {} failed: {}".format(self.url, e))
+
+
+class BufferedLineWriter(object):
+    """
+    Write lines to an ExportFile in batches of batch_size lines, every
+    batch is joined and written with a single write() call. Batches never
+    mix datapoints of two time buckets of the export file.
+    """
+
+    def __init__(self, export_file, batch_size=DEFAULT_EXPORT_BATCH_SIZE):
+        self.export_file = export_file
+        self.batch_size = max(1, batch_size)
+        self.lines = []
+        self.usecs = None
+
+    def write(self, line, usecs=None):
+        if usecs is not None and usecs != self.usecs:
+            self.usecs = usecs
+            bucket = self.export_file.time_bucket(usecs)
+            if bucket != self.export_file.bucket:
+                self.flush()
+                self.export_file.set_time_bucket(bucket)
+        self.lines.append(line)
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.export_file.write("".join(self.lines), len(self.lines))
+            self.lines = []
+
+    def close(self):
+        self.flush()
+        self.export_file.close()
 
 
 class UiExporter(Ui):
 
-    def __init__(self):
+    # Tags in lexicographic order to improve performance at influxDB
+    NODE_DATAPOINT_FORMAT = (
+        "node,"
+        "clusterId={cluster_id},"
+        "clusterName={cluster_name},"
+        "entityId={n[node_id]},"
+        "entityName={n[node_name]},"
+        "exportId={export_id} "
+        "hypervisorCpuUsagePercent={n[hypervisor_cpu_usage_percent]:.2f},"
+        "hypervisorMemoryUsagePercent={n[hypervisor_memory_usage_percent]:.2f},"
+        "controllerNumIops={n[controller_num_iops]:.0f},"
+        "hypervisorNumIops={n[hypervisor_num_iops]:.0f},"
+        "numIops={n[num_iops]:.0f},"
+        "ioBandwidthMBps={n[io_bandwidth_mBps]:.2f},"
+        "avgIoLatencyMsecs={n[avg_io_latency_msecs]:.2f} "
+        "{time_usec}\n"
+    )
+
+    VM_DATAPOINT_FORMAT = (
+        "vm,"
+        "clusterId={cluster_id},"
+        "clusterName={cluster_name},"
+        "entityId={v[id]},"
+        "entityName={vm_name},"
+        "exportId={export_id},"
+        "nodeName={v[node_name]} "
+        "hypervisorCpuUsagePercent={v[hypervisor_cpu_usage_percent]:.2f},"
+        "hypervisorCpuReadyTimePercent={v[hypervisor.cpu_ready_time_percent]:.2f},"
+        "memoryUsagePercent={v[memory_usage_percent]:.2f},"
+        "controllerNumIops={v[controller_num_iops]:.0f},"
+        "hypervisorNumIops={v[hypervisor_num_iops]:.0f},"
+        "controllerIoBandwidth_MBps={v[controller_io_bandwidth_mBps]:.2f},"
+        "controllerAvgIoLatency_msecs={v[controller_avg_io_latency_msecs]:.2f} "
+        "{time_usec}\n"
+    )
+
+    def __init__(self, jobs=DEFAULT_JOBS, cache_dir=DEFAULT_CACHE_DIR,
+                 cache_size=DEFAULT_CACHE_SIZE_MB,
+                 batch_size=None, compress=None,
+                 rotate_size=None, rotate_time=None, influx_url=None,
+                 influx_token=None, datasource=None, stats=None):
         """
         TODO:
           + Find a better way to get Y for pads, the use of overall_live_report()
             is an unnecessary call to arithmos.
         """
-        Ui.__init__(self)
-        self.export_file = "narf.{}.line".format(self.UiUuid)
+        Ui.__init__(self, jobs, cache_dir, cache_size, datasource=datasource,
+                    stats=stats)
+        import uuid
+        self.UiUuid = uuid.uuid1()
+        self.export_prefix = "narf.{}".format(self.UiUuid)
+        self.compress = compress
+        self.rotate_size = rotate_size
+        self.rotate_time = rotate_time
+        self.influx_url = influx_url
+        self.influx_token = influx_token
+        if batch_size:
+            self.batch_size = batch_size
+        elif influx_url:
+            self.batch_size = DEFAULT_INFLUX_BATCH_SIZE
+        else:
+            self.batch_size = DEFAULT_EXPORT_BATCH_SIZE
 
-    def write_node_datapoint(self, export_file, start_time, end_time,
-                             sort="name", hosts=[]):
+    def iter_intervals(self, start_time, end_time, sec, sort="name",
+                       agg="mean"):
         """
-        Get measurements for nodes.
+        First stage of the export pipeline. Fetch the time range one window
+        at a time and yields (interval start in usecs, nodes, vms) tuples
+        for every interval of sec seconds, only one window is kept in
+        memory.
         """
-        export_file.write("# Nodes datapoints for interval {}\n"
-                          .format(start_time.strftime("%Y/%m/%d-%H:%M:%S")))
-        usec_start = int(start_time.strftime("%s") + "000000")
-        usec_end = int(end_time.strftime("%s") + "000000")
-        nodes = self.node_reporter.overall_time_range_report(
-            usec_start, usec_end, sort)
+        for usec_start, usec_end in self._time_range_windows(
+                start_time, end_time, sec):
+            print("INFO: Collecting datapoints from {} to {}"
+                  .format(self._usecs_to_str(usec_start),
+                          self._usecs_to_str(usec_end)))
+            nodes_buckets = self.node_reporter.overall_time_range_buckets(
+                usec_start, usec_end, sec, sort, agg=agg)
+            vms_buckets = self.vm_reporter.overall_time_range_buckets(
+                usec_start, usec_end, sec, sort, agg=agg)
+            for (usec_step, nodes), (_, vms) in zip(nodes_buckets,
+                                                    vms_buckets):
+                yield usec_step, nodes, vms
+
+    def iter_node_datapoints(self, usec_start, nodes):
+        """
+        Yields line protocol datapoints for nodes in the interval starting
+        at usec_start.
+        """
+        yield ("# Nodes datapoints for interval {}\n"
+               .format(self._usecs_to_str(usec_start)))
         for node in nodes:
-            # Tags in lexicographic order to improve performance at influxDB
-            export_file.write("node,"
-                              "clusterId={cluster_id},"
-                              "clusterName={cluster_name},"
-                              "entityId={n[node_id]},"
-                              "entityName={n[node_name]},"
-                              "exportId={export_id} "
-                              "hypervisorCpuUsagePercent={n[hypervisor_cpu_usage_percent]:.2f},"
-                              "hypervisorMemoryUsagePercent={n[hypervisor_memory_usage_percent]:.2f},"
-                              "controllerNumIops={n[controller_num_iops]:.0f},"
-                              "hypervisorNumIops={n[hypervisor_num_iops]:.0f},"
-                              "numIops={n[num_iops]:.0f},"
-                              "ioBandwidthMBps={n[io_bandwidth_mBps]:.2f},"
-                              "avgIoLatencyMsecs={n[avg_io_latency_msecs]:.2f} "
-                              "{time_usec}\n"
-                              .format(export_id=self.UiUuid,
-                                      cluster_id=self.cluster_reporter.cluster_id,
-                                      cluster_name=self.cluster_reporter.name,
-                                      n=node,
-                                      time_usec=usec_start)
-                              )
-        return True
-
-    def write_vms_datapoint(self, export_file, start_time, end_time,
-                            sort="name", hosts=[]):
+            yield self.NODE_DATAPOINT_FORMAT.format(
+                export_id=self.UiUuid,
+                cluster_id=self.cluster_reporter.cluster_id,
+                cluster_name=self.cluster_reporter.name,
+                n=node,
+                time_usec=usec_start)
+
+    def iter_vms_datapoints(self, usec_start, vms):
         """
-        Get measurements for VMs.
+        Yields line protocol datapoints for VMs in the interval starting
+        at usec_start.
         """
-        export_file.write("# VMs datapoints for interval {}\n"
-                          .format(start_time.strftime("%Y/%m/%d-%H:%M:%S")))
-        usec_start = int(start_time.strftime("%s") + "000000")
-        usec_end = int(end_time.strftime("%s") + "000000")
-        vms = self.vm_reporter.overall_time_range_report(
-            usec_start, usec_end, sort)
+        yield ("# VMs datapoints for interval {}\n"
+               .format(self._usecs_to_str(usec_start)))
         for vm in vms:
-            # Tags in lexicographic order to improve performance at influxDB
-            export_file.write("vm,"
-                              "clusterId={cluster_id},"
-                              "clusterName={cluster_name},"
-                              "entityId={v[id]},"
-                              "entityName={vm_name},"
-                              "exportId={export_id},"
-                              "nodeName={v[node_name]} "
-                              "hypervisorCpuUsagePercent={v[hypervisor_cpu_usage_percent]:.2f},"
-                              "hypervisorCpuReadyTimePercent={v[hypervisor.cpu_ready_time_percent]:.2f},"
-                              "memoryUsagePercent={v[memory_usage_percent]:.2f},"
-                              "controllerNumIops={v[controller_num_iops]:.0f},"
-                              "hypervisorNumIops={v[hypervisor_num_iops]:.0f},"
-                              "controllerIoBandwidth_MBps={v[controller_io_bandwidth_mBps]:.2f},"
-                              "controllerAvgIoLatency_msecs={v[controller_avg_io_latency_msecs]:.2f} "
-                              "{time_usec}\n"
-                              .format(export_id=self.UiUuid,
-                                      cluster_id=self.cluster_reporter.cluster_id,
-                                      cluster_name=self.cluster_reporter.name,
-                                      v=vm,
-                                      vm_name=vm["vm_name"].replace(" ", "\ "),
-                                      time_usec=usec_start)
-                              )
-        return True
-
-    def export_data(self, start_time, end_time, sec=None, sort="name", nodes=[]):
+            yield self.VM_DATAPOINT_FORMAT.format(
+                export_id=self.UiUuid,
+                cluster_id=self.cluster_reporter.cluster_id,
+                cluster_name=self.cluster_reporter.name,
+                v=vm,
+                vm_name=vm["vm_name"].replace(" ", "\\ "),
+                time_usec=usec_start)
+
+    def iter_datapoints(self, intervals):
+        """
+        Second stage of the export pipeline. Convert the intervals yielded
+        by iter_intervals() to line protocol datapoints. Yields (interval
+        start in usecs, datapoint) tuples.
+        """
+        for usec_step, nodes, vms in intervals:
+            for line in self.iter_node_datapoints(usec_step, nodes):
+                yield usec_step, line
+            for line in self.iter_vms_datapoints(usec_step, vms):
+                yield usec_step, line
+
+    def export_data(self, start_time, end_time, sec=None, sort="name", nodes=[],
+                    agg="mean"):
         """
         Generate a report file.
+
+        Datapoints flow from arithmos to the files through a pipeline of
+        generators: iter_intervals() -> iter_datapoints() ->
+        BufferedLineWriter -> ExportFile (or InfluxWriteSink with
+        --influx-url), so memory doesn't grow with the time range.
         """
         sec = self.time_validator(start_time, end_time, sec)
         if sec > -1:
-            export_file = open(self.export_file, "a")
-            step_time = start_time
-            delta_time = start_time + datetime.timedelta(seconds=sec)
             print("INFO: Exporting datapoints. Collection ID: {}."
                   .format(self.UiUuid))
-            print("INFO: Export file: {}".format(self.export_file))
-            while step_time < end_time:
-                print("INFO: Collecting datapoints for interval {}"
-                      .format(step_time.strftime("%Y/%m/%d-%H:%M:%S")))
-                self.write_node_datapoint(export_file, step_time, delta_time,
-                                          sort, nodes)
-                self.write_vms_datapoint(export_file, step_time, delta_time,
-                                         sort, nodes)
-                step_time = delta_time
-                delta_time += datetime.timedelta(seconds=sec)
-            export_file.close()
+            try:
+                if self.influx_url:
+                    export_file = InfluxWriteSink(self.influx_url,
+                                                  self.influx_token)
+                    print("INFO: Pushing datapoints to: {}"
+                          .format(self.influx_url))
+                else:
+                    export_file = ExportFile(self.export_prefix,
+                                             self.compress, self.rotate_size,
+                                             self.rotate_time)
+                    print("INFO: Export files: {}.*"
+                          .format(self.export_prefix))
+
+                writer = BufferedLineWriter(export_file, self.batch_size)
+                intervals = self.iter_intervals(start_time, end_time, sec,
+                                                sort, agg)
+                # Reports pulled by the pipeline account their own time,
+                # what remains is formatting and writing the datapoints.
+                # The writer is closed even when the export is interrupted,
+                # so compressed files are complete and the manifest lists
+                # what was exported. A Ctrl-C in the middle of a write
+                # would leave the compressor inconsistent, it is raised
+                # once the write is done.
+                guard = {"writing": False, "interrupted": False}
+
+                def interrupt(signum, frame):
+                    if guard["writing"]:
+                        guard["interrupted"] = True
+                    else:
+                        raise KeyboardInterrupt
+
+                previous_handler = signal.signal(signal.SIGINT, interrupt)
+                try:
+                    with self.stats.phase("format"):
+                        for usec_step, line in self.iter_datapoints(
+                                intervals):
+                            guard["writing"] = True
+                            writer.write(line, usec_step)
+                            guard["writing"] = False
+                            if guard["interrupted"]:
+                                raise KeyboardInterrupt
+                finally:
+                    # Pushing to InfluxDB can retry for a while, it can
+                    # still be interrupted.
+                    guard["writing"] = not self.influx_url
+                    try:
+                        writer.close()
+                    finally:
+                        signal.signal(signal.SIGINT, previous_handler)
+                if guard["interrupted"]:
+                    raise KeyboardInterrupt
+            except InfluxWriteError as e:
+                print("ERROR: {}".format(e))
+                return False
+            except KeyboardInterrupt:
+                if not self.influx_url:
+                    print("INFO: Export interrupted. Manifest: {}"
+                          .format(export_file.manifest))
+                raise
+
+            if self.influx_url:
+                print("INFO: Pushed {} lines in {} batches."
+                      .format(export_file.lines, export_file.batches))
+            else:
+                for produced_file in export_file.files:
+                    print("INFO: Export file: {}"
+                          .format(produced_file["name"]))
+                print("INFO: Manifest: {}".format(export_file.manifest))
             print("INFO: Export completed.")
         return True
 
 
+class _NullExportFile(object):
+    """
+    ExportFile interface that only counts the bytes written, used to time
+    the export pipeline without disk I/O.
+    """
+
+    def __init__(self):
+        self.bucket = None
+        self.bytes = 0
+
+    def time_bucket(self, usecs):
+        return None
+
+    def set_time_bucket(self, bucket):
+        pass
+
+    def write(self, data, lines=0):
+        self.bytes += len(data)
+
+    def close(self):
+        pass
+
+
+class Benchmark(object):
+    """
+    Measure the cost of narf itself against a SyntheticDataSource.
+
+    Every case runs BENCHMARK_RUNS times, results are printed and written
+    to a JSON file with the minimum, median, mean and maximum time in
+    seconds and the number of RPCs per run of every case. When a previous
+    results file is given as baseline the change of the median time is
+    printed too, so versions can be compared.
+
+    Output printed by the code under measurement goes to /dev/null, the
+    interactive UI is drawn in a pseudo terminal of BENCHMARK_SCREEN_SIZE
+    and the bytes sent to it are counted. Startup cases run narf.py in new
+    processes against --synthetic.
+    """
+
+    def __init__(self, size=DEFAULT_BENCHMARK_SIZE, latency_ms=0,
+                 jobs=DEFAULT_JOBS, runs=BENCHMARK_RUNS):
+        _import_serialization()
+        self.num_nodes, self.num_vms, self.num_vgs, self.num_samples = \
+            [int(value) for value in size.split(",")]
+        self.latency_ms = latency_ms
+        self.jobs = jobs
+        self.runs = max(1, runs)
+        self.datasource = SyntheticDataSource(
+            self.num_nodes, self.num_vms, self.num_vgs, self.num_samples,
+            latency_ms)
+        self.stats = RpcStats()
+        self.results = {}
+
+    def _measure(self, name, func, **extra):
+        devnull = open(os.devnull, "w")
+        stdout = sys.stdout
+        times = []
+        rpcs = self.datasource.rpcs
+        try:
+            sys.stdout = devnull
+            for _ in range(self.runs):
+                start = timeit.default_timer()
+                func()
+                times.append(timeit.default_timer() - start)
+        finally:
+            sys.stdout = stdout
+            devnull.close()
+        times.sort()
+        result = {
+            "runs": self.runs,
+            "min": times[0],
+            "median": times[len(times) // 2],
+            "mean": sum(times) / len(times),
+            "max": times[-1],
+            "rpcs": (self.datasource.rpcs - rpcs) / self.runs
+        }
+        result.update(extra)
+        self.results[name] = result
+        return result
+
+    def bench_live_reports(self, ui):
+        node_reporter = ui.node_reporter
+        self._measure("live.nodes.overall", node_reporter.overall_live_report)
+        self._measure("live.nodes.iops", node_reporter.iops_live_report)
+        self._measure("live.nodes.bw", node_reporter.bw_live_report)
+        self._measure("live.nodes.lat", node_reporter.lat_live_report)
+        self._measure("live.vms.overall",
+                      lambda: ui.vm_reporter.overall_live_report("cpu"))
+        self._measure("live.vms.iops",
+                      lambda: ui.vm_reporter.iops_live_report("cpu"))
+        self._measure("live.vgs.overall",
+                      lambda: ui.vg_reporter.overall_live_report("iops"))
+        self._measure("live.vms.top",
+                      lambda: ui.vm_reporter.overall_live_report(
+                          "cpu", top=BENCHMARK_TOP))
+
+    def _time_range(self):
+        """
+        Time range covering num_samples samples of 30 seconds, in usecs.
+        """
+        end = int(time.time()) // 60 * 60 * 1000000
+        return end - self.num_samples * 30 * 1000000, end
+
+    def bench_time_range_reports(self, ui):
+        start, end = self._time_range()
+        self._measure("time_range.nodes.overall",
+                      lambda: ui.node_reporter.overall_time_range_buckets(
+                          start, end, 60))
+        self._measure("time_range.vms.overall",
+                      lambda: ui.vm_reporter.overall_time_range_buckets(
+                          start, end, 60, "cpu"))
+
+    def bench_export(self, exporter):
+        start, end = self._time_range()
+        start_time = datetime.datetime.fromtimestamp(start // 1000000)
+        end_time = datetime.datetime.fromtimestamp(end // 1000000)
+        export_file = _NullExportFile()
+
+        def export():
+            writer = BufferedLineWriter(export_file, exporter.batch_size)
+            intervals = exporter.iter_intervals(start_time, end_time, 60)
+            for usec_step, line in exporter.iter_datapoints(intervals):
+                writer.write(line, usec_step)
+            writer.close()
+
+        self._measure("export.line_protocol", export)
+        self.results["export.line_protocol"]["bytes"] = \
+            export_file.bytes // self.runs
+
+    def bench_helpers(self, ui):
+        vm_reporter = ui.vm_reporter
+        entity_list = vm_reporter._get_vm_live_stats(
+            field_list=VM_OVERALL_REPORT_ARITHMOS_FIELDS,
+            filter_criteria="power_state==on")
+        entities = vm_reporter._get_live_stats_dic(
+            entity_list, VM_OVERALL_REPORT_ARITHMOS_FIELDS)
+        converted = vm_reporter._stats_unit_conversion(entities)
+        str_time = datetime.datetime.now().strftime("%Y/%m/%d-%H:%M:%S")
+
+        self._measure("helpers.entity_stats_from_proto",
+                      lambda: [vm_reporter._get_entity_stats_from_proto(
+                          entity, VM_OVERALL_REPORT_ARITHMOS_FIELDS)
+                          for entity in entity_list])
+        self._measure("helpers.stats_unit_conversion",
+                      lambda: vm_reporter._stats_unit_conversion(entities))
+        self._measure("helpers.report_format_printer",
+                      lambda: ui._report_format_printer(
+                          VM_OVERALL_REPORT_CLI_FIELDS, converted, str_time))
+
+    def bench_memory(self, ui):
+        """
+        Memory retained by the VMs overall live report, as an EntityTable
+        and as the list of dictionaries it replaces. Needs tracemalloc.
+        """
+        tracemalloc = _import_optional("tracemalloc")
+        if tracemalloc is None:
+            return
+        vm_reporter = ui.vm_reporter
+
+        def retained(func):
+            tracemalloc.start()
+            try:
+                start = tracemalloc.get_traced_memory()[0]
+                value = func()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            del value
+            return current - start, peak - start
+
+        for name, func in [
+                ("memory.vms.table", vm_reporter.overall_live_report),
+                ("memory.vms.dicts",
+                 lambda: [dict(row.items())
+                          for row in vm_reporter.overall_live_report()])]:
+            result = self._measure(name, func)
+            result["retained_bytes"], result["peak_bytes"] = retained(func)
+
+    def bench_interactive(self):
+        """
+        Draw frames of the interactive UI in a pseudo terminal, refresh
+        ticks (fetch and draw) and redraws of the same snapshot (key
+        presses). The terminal output is drained from a thread and
+        counted.
+        """
+        import pty
+        import termios
+        _import_curses()
+        rows, cols = BENCHMARK_SCREEN_SIZE
+        master, slave = pty.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                    struct.pack("HHHH", rows, cols, 0, 0))
+        output = {"bytes": 0}
+
+        def drain():
+            while True:
+                try:
+                    data = os.read(master, 65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                output["bytes"] += len(data)
+
+        drainer = threading.Thread(target=drain)
+        drainer.daemon = True
+        drainer.start()
+
+        term = os.environ.get("TERM")
+        os.environ["TERM"] = "xterm-256color"
+        sys.stdout.flush()
+        saved_fds = os.dup(0), os.dup(1)
+        os.dup2(slave, 0)
+        os.dup2(slave, 1)
+        ui = None
+        try:
+            ui = UiInteractive(self.jobs, self.datasource, self.stats)
+            ui.render_frame()
+
+            def frame():
+                ui.refresh_live_stats()
+                ui.render_frame()
+
+            output["bytes"] = 0
+            self._measure("interactive.frame", frame)
+            frame_bytes = output["bytes"]
+            output["bytes"] = 0
+            self._measure("interactive.redraw", ui.render_frame)
+            redraw_bytes = output["bytes"]
+        finally:
+            if ui is not None:
+                ui.close()
+            curses.endwin()
+            os.dup2(saved_fds[0], 0)
+            os.dup2(saved_fds[1], 1)
+            for fd in saved_fds + (slave,):
+                os.close(fd)
+            if term is None:
+                del os.environ["TERM"]
+            else:
+                os.environ["TERM"] = term
+        drainer.join(1)
+        os.close(master)
+        self.results["interactive.frame"]["terminal_bytes"] = \
+            frame_bytes // self.runs
+        self.results["interactive.redraw"]["terminal_bytes"] = \
+            redraw_bytes // self.runs
+
+    def bench_startup(self):
+        """
+        Wall time of one-shots started as new processes, imports included:
+        -h, and -n and -v against a --synthetic cluster of the same size.
+        """
+        import subprocess
+        command = [sys.executable, os.path.abspath(__file__)]
+        synthetic = ["--synthetic", "--bench-size", "{},{},{},{}".format(
+            self.num_nodes, self.num_vms, self.num_vgs, self.num_samples),
+            "--bench-latency", str(self.latency_ms)]
+        failed = []
+        devnull = open(os.devnull, "w")
+        try:
+            for name, args in [("startup.help", ["-h"]),
+                               ("startup.nodes", synthetic + ["-n"]),
+                               ("startup.vms", synthetic + ["-v"])]:
+                def start(args=args, name=name):
+                    if subprocess.call(command + args, stdout=devnull,
+                                       stderr=devnull):
+                        failed.append(name)
+                self._measure(name, start)
+        finally:
+            devnull.close()
+        for name in sorted(set(failed)):
+            sys.stderr.write("WARNING: {} exited with an error\n".format(name))
+
+    def run(self, path, baseline=None):
+        ui = UiCli(self.jobs, None, datasource=self.datasource,
+                   stats=self.stats)
+        exporter = UiExporter(self.jobs, None, datasource=self.datasource,
+                              stats=self.stats)
+        self.bench_live_reports(ui)
+        self.bench_time_range_reports(ui)
+        self.bench_export(exporter)
+        self.bench_helpers(ui)
+        self.bench_memory(ui)
+        ui.close()
+        exporter.close()
+        self.bench_interactive()
+        self.bench_startup()
+
+        report = {
+            "version": 1,
+            "time": datetime.datetime.now().strftime("%Y/%m/%d-%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "cluster": {"nodes": self.num_nodes, "vms": self.num_vms,
+                        "vgs": self.num_vgs, "samples": self.num_samples},
+            "latency_ms": self.latency_ms,
+            "jobs": self.jobs,
+            "phases": self.stats.phase_totals(),
+            "results": self.results
+        }
+        with open(path, "w") as results_file:
+            json.dump(report, results_file, indent=2, sort_keys=True)
+
+        baseline_results = {}
+        if baseline:
+            with open(baseline) as baseline_file:
+                baseline_results = json.load(baseline_file)["results"]
+
+        print("{:<36} {:>10} {:>10} {:>10} {:>6} {:>8}".format(
+            "Case", "min[ms]", "med[ms]", "max[ms]", "RPCs", "vs base"))
+        for name in sorted(self.results):
+            result = self.results[name]
+            change = ""
+            if name in baseline_results and baseline_results[name]["median"]:
+                change = "{:+.1f}%".format(
+                    (result["median"] / baseline_results[name]["median"] - 1)
+                    * 100)
+            print("{:<36} {:>10.2f} {:>10.2f} {:>10.2f} {:>6g} {:>8}".format(
+                name, result["min"] * 1000, result["median"] * 1000,
+                result["max"] * 1000, result["rpcs"], change))
+        print("INFO: Benchmark results: {}".format(path))
+        return report
+
+
 def valid_date(date_string):
     try:
         return datetime.datetime.strptime(date_string, "%Y/%m/%d-%H:%M:%S")
@@ -1920,10 +4926,35 @@ def valid_date(date_string):
         raise argparse.ArgumentTypeError(msg)
 
 
+def valid_top(top_string):
+    try:
+        top = int(top_string)
+    except ValueError:
+        top = 0
+    if top < 1:
+        msg = "Invalid number of entities: {0!r}".format(top_string)
+        raise argparse.ArgumentTypeError(msg)
+    return top
+
+
+def valid_bench_size(size_string):
+    try:
+        values = [int(value) for value in size_string.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4 or min(values) < 0:
+        msg = "Invalid benchmark size: {0!r}".format(size_string)
+        raise argparse.ArgumentTypeError(msg)
+    return size_string
+
+
 # TODO: Need to do a better job here.
 #       Too much logic for a main function.
 #       Move this to a main class.
 if __name__ == "__main__":
+    # Closed on exit, Ctrl-C included, see the finally clause below.
+    datasource = None
+    ui_cli = ui_exporter = ui_interactive = None
     try:
         parser = argparse.ArgumentParser(
             description="Report cluster activity",
@@ -1942,9 +4973,16 @@ if __name__ == "__main__":
                             choices=["name", "cpu", "rdy", "mem",
                                      "iops", "bw", "lat", "vdisks"],
                             default="name", help="Sort output")
+        parser.add_argument('--top', type=valid_top, metavar="N",
+                            help="Only the first N VMs or VGs by --sort in "
+                            "live reports")
         parser.add_argument('--report-type', '-t',
                             choices=["iops", "bw", "lat"],
                             default="overall", help="Report type")
+        parser.add_argument('--agg', '-a',
+                            choices=TimeRangeAggregator.AGGREGATES,
+                            default="mean",
+                            help="Aggregate for time range reports")
         parser.add_argument("-start-time", "-S",
                             help="Start time in format YYYY/MM/DD-hh:mm:ss. "
                             "Specified in local time.",
@@ -1955,6 +4993,77 @@ if __name__ == "__main__":
                             type=valid_date)
         parser.add_argument('--export', '-e', action='store_true',
                             help="Export data to files in line protocol")
+        parser.add_argument('--batch-size', type=int,
+                            help="Number of datapoints written at once by "
+                            "--export. Default: " +
+                            str(DEFAULT_EXPORT_BATCH_SIZE) + ", " +
+                            str(DEFAULT_INFLUX_BATCH_SIZE) +
+                            " with --influx-url")
+        parser.add_argument('--compress', choices=["gzip", "xz"],
+                            help="Compress export files")
+        parser.add_argument('--rotate-size', type=int,
+                            help="Start a new export file every ROTATE_SIZE "
+                            "MB")
+        parser.add_argument('--rotate-time', choices=["hour", "day"],
+                            help="Start a new export file for every hour or "
+                            "day of data")
+        parser.add_argument('--influx-url',
+                            help="Push exported datapoints to an InfluxDB "
+                            "write endpoint instead of files, e.g. "
+                            "http://host:8086/api/v2/write?org=ORG&bucket=B")
+        parser.add_argument('--influx-token',
+                            default=os.environ.get("INFLUX_TOKEN"),
+                            help="InfluxDB API token. Default: INFLUX_TOKEN "
+                            "environment variable")
+        parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
+                            help="Maximum number of concurrent arithmos "
+                            "queries for time range reports")
+        parser.add_argument('--cache-dir',
+                            default=DEFAULT_CACHE_DIR,
+                            help="Directory to cache historic samples. "
+                            "Default: " + DEFAULT_CACHE_DIR)
+        parser.add_argument('--cache-size', type=int,
+                            default=DEFAULT_CACHE_SIZE_MB,
+                            help="Maximum size of the cache in MB. "
+                            "Default: " + str(DEFAULT_CACHE_SIZE_MB))
+        parser.add_argument('--no-cache', action='store_true',
+                            help="Don't use the cache of historic samples")
+        parser.add_argument('--save', metavar="FILE",
+                            help="Save the report in a snapshot file")
+        parser.add_argument('--load', metavar="FILE",
+                            help="Print a report saved with --save, "
+                            "it can be sorted again with --sort")
+        # Only one datasource can replace arithmos.
+        datasource_group = parser.add_mutually_exclusive_group()
+        datasource_group.add_argument('--record', metavar="FILE",
+                                      help="Record arithmos responses to a "
+                                      "file, they can be served back with "
+                                      "--replay")
+        datasource_group.add_argument('--replay', metavar="FILE",
+                                      help="Run reports against responses "
+                                      "recorded with --record instead of "
+                                      "arithmos")
+        datasource_group.add_argument('--synthetic', action='store_true',
+                                      help="Run reports against a synthetic "
+                                      "cluster of --bench-size instead of "
+                                      "arithmos")
+        parser.add_argument('--stats', action='store_true',
+                            help="Print arithmos calls, latency and time "
+                            "spent by narf at exit")
+        parser.add_argument('--benchmark', metavar="FILE",
+                            help="Measure narf against a synthetic cluster "
+                            "and write the results to FILE in JSON")
+        parser.add_argument('--bench-size',
+                            default=DEFAULT_BENCHMARK_SIZE,
+                            type=valid_bench_size,
+                            help="Synthetic cluster for --benchmark as "
+                            "NODES,VMS,VGS,SAMPLES. Default: " +
+                            DEFAULT_BENCHMARK_SIZE)
+        parser.add_argument('--bench-latency', type=float, default=0,
+                            help="Latency of every synthetic RPC in ms")
+        parser.add_argument('--bench-baseline', metavar="FILE",
+                            help="Compare --benchmark with a previous "
+                            "results file")
         parser.add_argument('--test', action='store_true',
                             help="Place holder for testing new features")
         parser.add_argument('sec', type=int, nargs="?", default=None,
@@ -1962,10 +5071,49 @@ if __name__ == "__main__":
         parser.add_argument('count', type=int, nargs="?", default=None,
                             help="Number of iterations")
         args = parser.parse_args()
+        cache_dir = None if args.no_cache else args.cache_dir
+
+        stats = RpcStats()
+        if args.stats:
+            # Live reports are usually stopped with Ctrl-C.
+            atexit.register(lambda: sys.stderr.write(stats.summary()))
+
+        exit_code = 0
+        if args.replay:
+            try:
+                datasource = ReplayDataSource(args.replay)
+            except (IOError, OSError, ValueError) as e:
+                sys.stderr.write("ERROR: Can't load recording: {}\n".format(e))
+                sys.exit(1)
+        elif args.synthetic:
+            datasource = SyntheticDataSource(
+                *[int(value) for value in args.bench_size.split(",")],
+                latency_ms=args.bench_latency)
+        elif args.record:
+            datasource = RecordingDataSource(ArithmosDataSource(), args.record)
+        if datasource:
+            # Samples served from the cache would be missing in the
+            # recording, and replayed samples must not end in the cache.
+            cache_dir = None
+
+        if args.benchmark:
+            Benchmark(args.bench_size, args.bench_latency,
+                      args.jobs).run(args.benchmark, args.bench_baseline)
+
+        elif args.load:
+            try:
+                if not UiCli(connect=False).snapshot_report(args.load,
+                                                            args.sort):
+                    exit_code = 1
+            except KeyboardInterrupt:
+                print("Narf!")
+                exit(0)
 
-        if args.nodes:
+        elif args.nodes:
             try:
-                ui_cli = UiCli()
+                ui_cli = UiCli(args.jobs, cache_dir, args.cache_size,
+                               args.save, datasource=datasource,
+                               stats=stats)
 
                 if not args.start_time and not args.end_time:
                     ui_cli.nodes_live_report(
@@ -1975,11 +5123,13 @@ if __name__ == "__main__":
                                                    args.end_time,
                                                    args.sec,
                                                    args.sort,
-                                                   report_type=args.report_type)
+                                                   report_type=args.report_type,
+                                                   agg=args.agg)
                 else:
                     parser.print_usage()
                     print("ERROR: Invalid date: Arguments --start-time and "
                           "--end-time should come together")
+                ui_cli.close_snapshot()
 
             except KeyboardInterrupt:
                 print("Narf!")
@@ -1987,24 +5137,29 @@ if __name__ == "__main__":
 
         elif args.uvms:
             try:
-                ui_cli = UiCli()
+                ui_cli = UiCli(args.jobs, cache_dir, args.cache_size,
+                               args.save, datasource=datasource,
+                               stats=stats)
                 if not args.start_time and not args.end_time:
                     ui_cli.uvms_live_report(args.sec,
                                             args.count,
                                             args.sort,
                                             args.node_name,
-                                            args.report_type)
+                                            args.report_type,
+                                            args.top)
                 elif args.start_time and args.end_time:
                     ui_cli.uvms_time_range_report(args.start_time,
                                                   args.end_time,
                                                   args.sec,
                                                   args.sort,
                                                   args.node_name,
-                                                  report_type=args.report_type)
+                                                  report_type=args.report_type,
+                                                  agg=args.agg)
                 else:
                     parser.print_usage()
                     print("ERROR: Invalid date: Arguments --start-time and "
                           "--end-time should come together")
+                ui_cli.close_snapshot()
 
             except KeyboardInterrupt:
                 print("Zort!")
@@ -2012,11 +5167,14 @@ if __name__ == "__main__":
 
         elif args.volume_groups:
             try:
-                ui_cli = UiCli()
+                ui_cli = UiCli(args.jobs, cache_dir, args.cache_size,
+                               args.save, datasource=datasource,
+                               stats=stats)
                 if not args.start_time and not args.end_time:
                     ui_cli.vg_live_report(args.sec,
                                           args.count,
-                                          args.sort)
+                                          args.sort,
+                                          top=args.top)
                 else:
                     ui_cli.vg_time_range_report(args.start_time,
                                                 args.end_time,
@@ -2024,26 +5182,51 @@ if __name__ == "__main__":
                                                 args.sort,
                                                 args.node_name,
                                                 report_type=args.report_type)
+                ui_cli.close_snapshot()
             except KeyboardInterrupt:
                 print("Zort!")
                 exit(0)
 
         elif args.export:
-            if args.start_time and args.end_time:
-                ui_exporter = UiExporter()
-                ui_exporter.export_data(
-                    args.start_time, args.end_time, args.sec)
-            else:
-                parser.print_usage()
-                print("ERROR: Invalid date: Arguments --start-time and"
-                      " --end-time needed by --export argument.")
+            try:
+                if args.compress == "xz" and \
+                        _import_optional("lzma") is None:
+                    parser.print_usage()
+                    print("ERROR: xz compression needs the lzma module, "
+                          "use --compress gzip instead.")
+                elif args.start_time and args.end_time:
+                    ui_exporter = UiExporter(args.jobs, cache_dir,
+                                             args.cache_size, args.batch_size,
+                                             args.compress, args.rotate_size,
+                                             args.rotate_time, args.influx_url,
+                                             args.influx_token, datasource,
+                                             stats)
+                    if not ui_exporter.export_data(
+                            args.start_time, args.end_time, args.sec,
+                            agg=args.agg):
+                        exit_code = 1
+                else:
+                    parser.print_usage()
+                    print("ERROR: Invalid date: Arguments --start-time and"
+                          " --end-time needed by --export argument.")
+            except KeyboardInterrupt:
+                print("Narf!")
+                exit(0)
         elif args.test:
             print("==== TESTING ====")
 
         else:
-            ui_interactive = UiInteractive()
+            ui_interactive = UiInteractive(args.jobs, datasource, stats,
+                                           args.sec)
             curses.wrapper(ui_interactive.render_main_screen)
 
+        if exit_code:
+            sys.exit(exit_code)
+
+    except ReplayError as e:
+        sys.stderr.write("ERROR: {}\n".format(e))
+        sys.exit(1)
+
     except IOError:
         # Python flushes standard streams on exit; redirect remaining output
         # to devnull to avoid another BrokenPipeError at shutdown
@@ -2051,3 +5234,10 @@ if __name__ == "__main__":
         devnull = os.open(os.devnull, os.O_WRONLY)
         os.dup2(devnull, sys.stdout.fileno())
         sys.exit(1)  # Python exits with error code 1 on EPIPE
+
+    finally:
+        for ui in (ui_cli, ui_exporter, ui_interactive):
+            if ui:
+                ui.close()
+        if datasource:
+            datasource.close()
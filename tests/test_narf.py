@@ -0,0 +1,465 @@
+"""
+Behavior tests for narf, run from the repository root with:
+
+  python -m unittest discover tests
+
+Reports run against SyntheticDataSource, which needs the arithmos protos
+of a CVM, those tests are skipped elsewhere. The cache, the aggregator,
+recordings and the exporter sinks are tested everywhere.
+"""
+
+import os
+import sys
+import gzip
+import json
+import zlib
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+
+try:
+    from StringIO import StringIO
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from io import StringIO
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import narf  # noqa: E402
+
+try:
+    narf._import_arithmos()
+    HAVE_ARITHMOS = True
+except ImportError:
+    HAVE_ARITHMOS = False
+
+needs_arithmos = unittest.skipUnless(HAVE_ARITHMOS,
+                                     "arithmos protos are not available")
+
+HOUR_USECS = 3600 * 1000000
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="narf-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+
+    def path(self, *names):
+        return os.path.join(self.tmp_dir, *names)
+
+
+def capture_stdout(func, *args, **kwargs):
+    """
+    Returns what func prints to stdout.
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        func(*args, **kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def settled_hour(hours_ago):
+    """
+    Start of the hour hours_ago hours ago, old enough to be cached.
+    """
+    now = int(time.time()) * 1000000
+    return (now // HOUR_USECS - hours_ago) * HOUR_USECS
+
+
+if HAVE_ARITHMOS:
+    class TimeSyntheticDataSource(narf.SyntheticDataSource):
+        """
+        SyntheticDataSource with samples aligned to the sampling interval
+        that only depend on the entity, stat and time of the sample, like
+        in arithmos, so any window returns the same samples for the same
+        times.
+        """
+
+        def get_time_range_stats(self, entity_type, batch, start, end,
+                                 sampling_interval):
+            self._rpc()
+            interval_usecs = sampling_interval * 1000000
+            first = -(-start // interval_usecs) * interval_usecs
+            batch_series = []
+            for entity_id, stat in batch:
+                samples = self.sample_pool[zlib.crc32("{}|{}".format(
+                    entity_id, stat).encode("utf-8")) % self.SAMPLE_POOL]
+                batch_series.append((first, sampling_interval, [
+                    samples[usecs // interval_usecs % len(samples)]
+                    for usecs in range(first, end, interval_usecs)]))
+            return batch_series
+
+
+class TimeRangeStatsCacheTest(TempDirTestCase):
+
+    def series(self, start, end, interval, offset=0):
+        interval_usecs = interval * 1000000
+        return (start, interval, [offset + i for i in range(
+            (end - start) // interval_usecs)])
+
+    def test_get_returns_what_was_put(self):
+        start = settled_hour(10)
+        end = start + 3 * HOUR_USECS
+        cache = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        series = {("vm1", "num_iops"): self.series(start, end, 60),
+                  ("vm2", "num_iops"): self.series(start, end, 60, 1000)}
+        cache.put(3, series, start, end, 60)
+
+        # One segment per block, read back by a new cache.
+        self.assertEqual(len(os.listdir(self.path("c1"))), 3)
+        cache = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        self.assertEqual(cache.get(3, list(series), start, end, 60), series)
+
+        # Any window inside the cached blocks.
+        span = cache.cacheable_span(start + HOUR_USECS // 2,
+                                    end - 2 * HOUR_USECS + 1)
+        self.assertEqual(span, (start, end - HOUR_USECS))
+        cached = cache.get(3, [("vm2", "num_iops")], span[0], span[1], 60)
+        self.assertEqual(cached[("vm2", "num_iops")], cache.slice_series(
+            series[("vm2", "num_iops")], span[0], span[1]))
+
+    def test_missing_series_and_blocks(self):
+        start = settled_hour(10)
+        cache = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        cache.put(3, {("vm1", "num_iops"): self.series(
+            start, start + HOUR_USECS, 60)}, start, start + HOUR_USECS, 60)
+        self.assertEqual(cache.get(3, [("vm2", "num_iops")], start,
+                                   start + HOUR_USECS, 60), {})
+        self.assertEqual(cache.get(3, [("vm1", "num_iops")], start,
+                                   start + 2 * HOUR_USECS, 60), {})
+        self.assertEqual(cache.get(3, [("vm1", "num_iops")], start,
+                                   start + HOUR_USECS, 300), {})
+
+    def test_corrupted_segment_is_a_miss(self):
+        start = settled_hour(10)
+        end = start + HOUR_USECS
+        cache = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        cache.put(3, {("vm1", "num_iops"): self.series(start, end, 60)},
+                  start, end, 60)
+        segment, = os.listdir(self.path("c1"))
+        with open(self.path("c1", segment), "wb") as segment_file:
+            segment_file.write(b"not a segment")
+        self.assertEqual(cache.get(3, [("vm1", "num_iops")], start, end, 60),
+                         {})
+
+    def test_cacheable_span(self):
+        cache = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        start = settled_hour(10)
+        self.assertEqual(cache.cacheable_span(start + 1, start + 2),
+                         (start, start + HOUR_USECS))
+        now = int(time.time()) * 1000000
+        self.assertIsNone(cache.cacheable_span(now - 60000000, now))
+
+    def test_evicts_least_recently_used_segments_of_any_cluster(self):
+        start = settled_hour(10)
+        end = start + 2 * HOUR_USECS
+        old = narf.TimeRangeStatsCache("c1", self.tmp_dir)
+        old.put(3, dict((("vm{}".format(i), "num_iops"),
+                         self.series(start, end, 30, i))
+                        for i in range(20)), start, end, 30)
+        oldest, older = sorted(os.listdir(self.path("c1")))
+        os.utime(self.path("c1", oldest), (1, 1))
+        os.utime(self.path("c1", older), (2, 2))
+        max_size = (os.path.getsize(self.path("c1", oldest)) +
+                    os.path.getsize(self.path("c1", older)))
+
+        new = narf.TimeRangeStatsCache("c2", self.tmp_dir,
+                                       max_size / 1048576.0)
+        new.put(3, {("vm1", "num_iops"): self.series(start, end, 60)},
+                start, end, 60)
+        self.assertEqual(os.listdir(self.path("c1")), [older])
+        self.assertEqual(len(os.listdir(self.path("c2"))), 2)
+
+
+class TimeRangeAggregatorTest(unittest.TestCase):
+
+    def series_list(self, start, end):
+        rnd = random.Random(0)
+        series_list = [None]
+        for i in range(40):
+            interval = rnd.choice([30, 60, 300])
+            series_start = start + rnd.randint(-10, 10) * 60000000
+            count = rnd.randint(0, (end - start) // 1000000 // interval)
+            series_list.append((series_start, interval, [
+                rnd.choice([-1, rnd.randint(0, 100000)])
+                for _ in range(count)]))
+        series_list.append((start, 60, [-1] * 10))
+        return series_list
+
+    @unittest.skipIf(narf._import_optional("numpy") is None,
+                     "numpy is not installed")
+    def test_numpy_and_python_agree(self):
+        start = 1600000000 * 1000000
+        end = start + 2 * HOUR_USECS
+        series_list = self.series_list(start, end)
+        divisors = [1 + i % 3 for i in range(len(series_list))]
+        for agg in narf.TimeRangeAggregator.AGGREGATES:
+            aggregator = narf.TimeRangeAggregator(agg)
+            python_aggregator = narf.TimeRangeAggregator(agg)
+            python_aggregator.numpy = None
+            for bucket_usecs in (300 * 1000000, HOUR_USECS):
+                num_buckets = (end - start) // bucket_usecs
+                expected = python_aggregator.aggregate(
+                    series_list, start, bucket_usecs, num_buckets, divisors)
+                got = aggregator.aggregate(series_list, start, bucket_usecs,
+                                           num_buckets, divisors)
+                self.assertEqual(len(got), len(expected))
+                for got_values, expected_values in zip(got, expected):
+                    self.assertEqual(len(got_values), num_buckets)
+                    for got_value, expected_value in zip(got_values,
+                                                         expected_values):
+                        self.assertAlmostEqual(got_value, expected_value,
+                                               places=6, msg=agg)
+
+    def test_intervals_without_data(self):
+        aggregator = narf.TimeRangeAggregator("max")
+        aggregator.numpy = None
+        start = 1600000000 * 1000000
+        self.assertEqual(aggregator.aggregate(
+            [None, (start, 60, [5, -1, 7, -1, -1, -1])], start, 180000000,
+            2), [[-1, -1], [7, -1]])
+
+
+class RecordingTest(TempDirTestCase):
+
+    def test_records_are_read_back(self):
+        recording = narf.DataSourceRecording(self.path("rec"))
+        recording.open()
+        recording.add_record({"type": "entities", "key": "k"}, b"\x00\x01")
+        recording.add_record({"type": "time_range", "keys": []})
+        recording.close()
+        self.assertEqual(
+            list(narf.DataSourceRecording(self.path("rec")).records()),
+            [({"type": "entities", "key": "k"}, b"\x00\x01"),
+             ({"type": "time_range", "keys": []}, b"")])
+
+    def test_invalid_recordings(self):
+        with open(self.path("rec"), "wb") as recording_file:
+            recording_file.write(b"something else")
+        self.assertRaises(
+            ValueError,
+            list, narf.DataSourceRecording(self.path("rec")).records())
+
+        recording = narf.DataSourceRecording(self.path("rec"))
+        recording.open()
+        recording.add_record({"type": "time_range", "keys": []})
+        recording.close()
+        with open(self.path("rec"), "rb") as recording_file:
+            data = recording_file.read()
+        with open(self.path("rec"), "wb") as recording_file:
+            recording_file.write(data[:-4])
+        self.assertRaises(
+            ValueError,
+            list, narf.DataSourceRecording(self.path("rec")).records())
+
+    @needs_arithmos
+    def test_replay_serves_recorded_time_range_stats(self):
+        start = settled_hour(10)
+        end = start + HOUR_USECS
+        batch = [("vm-0001", "num_iops"), ("vm-0002", "num_iops")]
+        recorder = narf.RecordingDataSource(
+            narf.SyntheticDataSource(num_vms=4), self.path("rec"))
+        recorded = recorder.get_time_range_stats(
+            narf.ArithmosEntityProto.kVM, batch, start, end, 60)
+        recorder.close()
+
+        replay = narf.ReplayDataSource(self.path("rec"))
+        self.assertEqual(
+            replay.get_time_range_stats(narf.ArithmosEntityProto.kVM,
+                                        batch, start, end, 60),
+            [(series[0], series[1], list(series[2]))
+             for series in recorded])
+        # Other queries were not recorded.
+        self.assertEqual(
+            replay.get_time_range_stats(narf.ArithmosEntityProto.kVM,
+                                        batch, start, end, 300),
+            [None, None])
+        self.assertRaises(narf.ReplayError, replay.get_entities_stats,
+                          narf.ArithmosEntityProto.kVM)
+
+
+@needs_arithmos
+class ReportTest(TempDirTestCase):
+
+    def report(self, datasource, cache_dir=None, save=None):
+        ui = narf.UiCli(2, cache_dir, save=save, datasource=datasource)
+        try:
+            start = datetime.datetime.fromtimestamp(
+                settled_hour(30) // 1000000 + 420)
+            end = start + datetime.timedelta(hours=3)
+            return capture_stdout(ui.uvms_time_range_report, start, end,
+                                  300, "num_iops")
+        finally:
+            ui.close_snapshot()
+            ui.close()
+
+    def test_cache_on_and_off_report_the_same(self):
+        datasource = TimeSyntheticDataSource(2, 30, 2, 20)
+        uncached = self.report(datasource)
+
+        rpcs = datasource.rpcs
+        cold = self.report(datasource, self.tmp_dir)
+        cold_rpcs = datasource.rpcs - rpcs
+        rpcs = datasource.rpcs
+        warm = self.report(datasource, self.tmp_dir)
+        warm_rpcs = datasource.rpcs - rpcs
+
+        self.assertTrue(uncached.strip())
+        self.assertEqual(cold, uncached)
+        self.assertEqual(warm, uncached)
+        self.assertLess(warm_rpcs, cold_rpcs)
+
+    def test_saved_report_loads_the_same(self):
+        datasource = narf.SyntheticDataSource(2, 30, 2, 20)
+        ui = narf.UiCli(2, None, save=self.path("report.snap"),
+                        datasource=datasource)
+        try:
+            printed = capture_stdout(ui.uvms_live_report, 0, 1)
+        finally:
+            ui.close_snapshot()
+            ui.close()
+
+        loaded = capture_stdout(narf.UiCli(connect=False).snapshot_report,
+                                self.path("report.snap"))
+        self.assertTrue(printed.strip())
+        self.assertEqual(loaded, printed)
+
+    def test_saved_time_range_report_loads_the_same(self):
+        datasource = TimeSyntheticDataSource(2, 30, 2, 20)
+        printed = self.report(datasource, save=self.path("report.snap"))
+        loaded = capture_stdout(narf.UiCli(connect=False).snapshot_report,
+                                self.path("report.snap"), "num_iops")
+        self.assertEqual(loaded, printed)
+
+
+class ExportFileTest(TempDirTestCase):
+
+    def manifest(self):
+        with open(self.path("narf.manifest")) as manifest_file:
+            return json.load(manifest_file)
+
+    def test_rotate_by_size(self):
+        export_file = narf.ExportFile(self.path("narf"), rotate_size_mb=1)
+        chunk = b"x" * 1048576
+        for _ in range(3):
+            export_file.write(chunk, 1)
+        export_file.close()
+
+        manifest = self.manifest()
+        self.assertEqual([f["name"] for f in manifest["files"]],
+                         [self.path("narf.{}.line".format(i))
+                          for i in range(3)])
+        for f in manifest["files"]:
+            self.assertEqual(f["lines"], 1)
+            self.assertEqual(f["bytes"], len(chunk))
+            self.assertEqual(os.path.getsize(f["name"]), len(chunk))
+
+    def test_rotate_by_time_with_compression(self):
+        export_file = narf.ExportFile(self.path("narf"), compress="gzip",
+                                      rotate_time="hour")
+        writer = narf.BufferedLineWriter(export_file, batch_size=10)
+        start = settled_hour(10)
+        lines = {}
+        for i in range(6):
+            usecs = start + i * HOUR_USECS // 3
+            line = "vm value={} {}\n".format(i, usecs)
+            writer.write(line, usecs)
+            lines.setdefault(export_file.time_bucket(usecs), []).append(line)
+        writer.close()
+
+        manifest = self.manifest()
+        self.assertEqual(manifest["compress"], "gzip")
+        self.assertEqual([f["time_bucket"] for f in manifest["files"]],
+                         sorted(lines))
+        for f in manifest["files"]:
+            self.assertTrue(f["name"].endswith(
+                ".{}.line.gz".format(f["time_bucket"])))
+            with gzip.open(f["name"]) as export:
+                self.assertEqual(export.read().decode("utf-8"),
+                                 "".join(lines[f["time_bucket"]]))
+            self.assertEqual(f["lines"], len(lines[f["time_bucket"]]))
+
+
+class InfluxWriteSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.statuses = []
+        self.requests = []
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                test.requests.append((self.path, body))
+                status = test.statuses.pop(0) if test.statuses else 204
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = "http://127.0.0.1:{}/api/v2/write?bucket=narf".format(
+            self.server.server_address[1])
+        self.backoff = narf.INFLUX_RETRY_BACKOFF_SECS
+        narf.INFLUX_RETRY_BACKOFF_SECS = 0.01
+
+    def tearDown(self):
+        narf.INFLUX_RETRY_BACKOFF_SECS = self.backoff
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batches_are_written(self):
+        sink = narf.InfluxWriteSink(self.url)
+        sink.write("vm value=1 1\n", 1)
+        sink.write("vm value=2 2\nvm value=3 3\n", 2)
+        sink.close()
+        self.assertEqual(self.requests, [
+            ("/api/v2/write?bucket=narf&precision=us", b"vm value=1 1\n"),
+            ("/api/v2/write?bucket=narf&precision=us",
+             b"vm value=2 2\nvm value=3 3\n")])
+        self.assertEqual((sink.batches, sink.lines), (2, 3))
+
+    def test_retries_429_and_5xx(self):
+        self.statuses = [503, 429]
+        sink = narf.InfluxWriteSink(self.url, retries=2)
+        sink.write("vm value=1 1\n", 1)
+        sink.close()
+        self.assertEqual([body for _, body in self.requests],
+                         [b"vm value=1 1\n"] * 3)
+        self.assertEqual((sink.batches, sink.lines), (1, 1))
+
+    def test_fails_after_retries(self):
+        self.statuses = [503, 503]
+        sink = narf.InfluxWriteSink(self.url, retries=1)
+        sink.write("vm value=1 1\n", 1)
+        self.assertRaises(narf.InfluxWriteError, sink.close)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_client_errors_are_not_retried(self):
+        self.statuses = [400]
+        sink = narf.InfluxWriteSink(self.url)
+        sink.write("vm value=1 1\n", 1)
+        self.assertRaises(narf.InfluxWriteError, sink.close)
+        self.assertEqual(len(self.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()